@@ -0,0 +1,124 @@
+# in-memory caches for results which are expensive to compute (or, like open
+# feature iterators, to recreate) but only useful for a while, and tracking of
+# the map layers they are derived from. the caches themselves are in lru.py
+
+from .lru import DiskCache, LRUCache
+import os
+
+# data versions of map layers, which are incremented whenever their features
+# change. cached results derived from a layer can include its version in
+# their key to make sure they are never used once outdated
+from qgis.core import QgsMapLayerRegistry
+
+versions = {}
+
+# render versions of map layers, which are incremented whenever their data
+# changes or they have to be redrawn for some other reason (changed style or
+# renderer, selection, ...). for caches of rendered maps
+renderVersions = {}
+
+# caches whose keys start with a layer id, their entries are removed as soon
+# as the layer's data changes or the layer is removed
+layerCaches = []
+
+# functions called with the id of a layer whenever it has to be redrawn
+# (including changes of its data) or was removed, for caches of rendered maps
+renderListeners = []
+
+# functions called with the id of a layer when it is removed, for state kept
+# by layer id other than caches (layer ids are reused when a project is
+# loaded again)
+removalListeners = []
+
+# signals of QgsMapLayer and its subclasses indicating changed data
+LAYER_CHANGE_SIGNALS = ['dataChanged', 'layerModified', 'editingStopped']
+# signals indicating that a layer has to be redrawn, but not necessarily
+# changed data (also emitted after a change of its style, or its selection)
+LAYER_REPAINT_SIGNALS = ['repaintRequested']
+
+def layerCache(cache):
+    """Register a cache whose keys start with a layer id, see layerCaches"""
+    layerCaches.append(cache)
+    return cache
+
+# whether layerRemoved() is connected to the layer registry
+trackingRemovals = False
+
+def trackLayerRemovals():
+    global trackingRemovals
+    if not trackingRemovals:
+        QgsMapLayerRegistry.instance().layerWillBeRemoved.connect(layerRemoved)
+        trackingRemovals = True
+
+def trackLayer(layer):
+    """Start to track the changes of a layer, if necessary"""
+    id = layer.id()
+    if id in versions:
+        return
+    trackLayerRemovals()
+    versions[id] = 0
+    renderVersions[id] = 0
+    connectSignals(layer, LAYER_CHANGE_SIGNALS, lambda *_: layerChanged(id))
+    connectSignals(layer, LAYER_REPAINT_SIGNALS, lambda *_: layerRepainted(id))
+
+def connectSignals(layer, names, slot):
+    for name in names:
+        signal = getattr(layer, name, None)
+        if signal != None:
+            signal.connect(slot)
+
+def layerVersion(layer):
+    """Return the current data version of a layer, starting to track its
+    changes if necessary"""
+    trackLayer(layer)
+    return versions[layer.id()]
+
+def renderVersion(layer):
+    """Return the current render version of a layer, starting to track its
+    changes if necessary"""
+    trackLayer(layer)
+    return renderVersions[layer.id()]
+
+def discardLayer(id):
+    for cache in layerCaches:
+        cache.discard(lambda key: key[0] == id)
+
+def layerChanged(id):
+    if id in versions:
+        versions[id] = versions[id] + 1
+    discardLayer(id)
+    layerRepainted(id)
+
+def layerRepainted(id):
+    if id in renderVersions:
+        renderVersions[id] = renderVersions[id] + 1
+    for listener in renderListeners:
+        listener(id)
+
+def layerRemoved(id):
+    versions.pop(id, None)
+    renderVersions.pop(id, None)
+    discardLayer(id)
+    for listener in renderListeners + removalListeners:
+        listener(id)
+
+from uuid import uuid4
+
+# identifies this QGIS session in the keys of cached images of layers whose
+# data can't be recognised across sessions
+SESSION = uuid4().hex
+
+def sourceStamp(layer):
+    """Return a string identifying the state of the data source of a layer
+    across QGIS sessions (unlike its layer version, which starts over in every
+    session). For file-based layers, this is the modification time and size
+    of their files. Images of other layers (databases, memory layers) can only
+    be reused within the current session."""
+    path = layer.source().split('|')[0]
+    if not os.path.isfile(path):
+        return SESSION
+    paths = [path]
+    if path.lower().endswith('.shp') and os.path.isfile(path[:-4] + '.dbf'):
+        # attributes are stored separately
+        paths.append(path[:-4] + '.dbf')
+    return ','.join('%r:%d' % (os.path.getmtime(path), os.path.getsize(path)) for path in paths)
@@ -0,0 +1,367 @@
+# binary alternatives to the JSON encoding of response bodies, which clients
+# can ask for through the 'Accept' header of their request. the same
+# conversions of Qt and QGIS types as for JSON apply (see the QGISJSONEncoder
+# in registry.py)
+
+from .registry import QGISJSONEncoder, lazyElements
+from collections import OrderedDict
+import struct
+
+def toPrimitive(o):
+    """Convert an object to basic python types using the functions registered
+    with the QGISJSONEncoder"""
+    function = QGISJSONEncoder.lookup(type(o))
+    if function == None:
+        raise TypeError(repr(o) + ' is not serializable')
+    return function(o)
+
+# MessagePack support requires the msgpack module
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def toMsgPack(o):
+    """Encode a response body as MessagePack. MessagePack arrays have to
+    announce their length up front, so lazy sequences (such as the features
+    of a getFeatures request) are instead streamed as a sequence of objects,
+    one per element, without an enclosing array. Clients read them with a
+    streaming unpacker, e.g. msgpack.Unpacker."""
+    packer = msgpack.Packer(default=toPrimitive)
+    if isinstance(o, QGISJSONEncoder.LAZY_SEQUENCES):
+        for element in lazyElements(o):
+            yield packer.pack(element)
+    else:
+        yield packer.pack(o)
+
+# CBOR (RFC 7049) is simple enough to not warrant another dependency. only the
+# data types that can result from the JSON conversions are supported
+
+def cborHead(major, n):
+    """Encode the initial byte(s) of a data item of the given major type"""
+    if n < 24:
+        return chr(major << 5 | n)
+    elif n < 0x100:
+        return struct.pack('>BB', major << 5 | 24, n)
+    elif n < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, n)
+    elif n < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, n)
+    return struct.pack('>BQ', major << 5 | 27, n)
+
+def cborInteger(o, out):
+    if o >= 0:
+        out.append(cborHead(0, o))
+    else:
+        out.append(cborHead(1, -1 - o))
+
+def cborString(o, out):
+    if isinstance(o, unicode):
+        o = o.encode('utf-8')
+    # byte strings are treated as (utf-8) text as well, since that's what
+    # they are throughout QGIS and this plugin
+    out.append(cborHead(3, len(o)))
+    out.append(o)
+
+def cborArray(o, out):
+    out.append(cborHead(4, len(o)))
+    for element in o:
+        cborEncode(element, out)
+
+def cborMap(o, out):
+    out.append(cborHead(5, len(o)))
+    for key, value in o.iteritems():
+        cborEncode(key, out)
+        cborEncode(value, out)
+
+CBOR_ENCODERS = {
+    type(None): lambda o, out: out.append('\xf6'),
+    bool: lambda o, out: out.append('\xf5' if o else '\xf4'),
+    int: cborInteger,
+    long: cborInteger,
+    float: lambda o, out: out.append(struct.pack('>Bd', 0xfb, o)),
+    str: cborString,
+    unicode: cborString,
+    list: cborArray,
+    tuple: cborArray,
+    dict: cborMap,
+    OrderedDict: cborMap
+}
+
+def cborEncode(o, out):
+    """Append the CBOR encoding of the given object to the list 'out'"""
+    encoder = CBOR_ENCODERS.get(type(o))
+    if encoder == None:
+        cborEncode(toPrimitive(o), out)
+    else:
+        encoder(o, out)
+
+def toCBOR(o):
+    """Encode a response body as CBOR"""
+    if isinstance(o, QGISJSONEncoder.LAZY_SEQUENCES):
+        # lazy sequences are streamed as an array of indefinite length
+        yield '\x9f'
+        for element in lazyElements(o):
+            out = []
+            cborEncode(element, out)
+            yield ''.join(out)
+        yield '\xff'
+    else:
+        out = []
+        cborEncode(o, out)
+        yield ''.join(out)
+
+# supported binary response formats by content type
+BINARY_FORMATS = OrderedDict([('application/cbor', toCBOR)])
+if msgpack != None:
+    BINARY_FORMATS['application/msgpack'] = toMsgPack
+    BINARY_FORMATS['application/x-msgpack'] = toMsgPack
+
+# columnar export of feature attributes, for clients which process whole
+# attribute tables at once. both formats include the feature ids in a column
+# named '$id' (as in QGIS expressions), followed by one column per field
+
+from PyQt4.QtCore import QPyNullVariant, QVariant
+from StringIO import StringIO
+
+# field types which are exported as numbers, all others end up as strings
+NUMERIC_TYPES = {
+    QVariant.Bool: 'bool',
+    QVariant.Int: 'int32',
+    QVariant.UInt: 'uint32',
+    QVariant.LongLong: 'int64',
+    QVariant.ULongLong: 'uint64',
+    QVariant.Double: 'float64'
+}
+
+def attributeBatches(layer, features, attributes=None, size=None):
+    """Collect the ids and attributes of the given features of a layer into
+    one list per column, optionally restricted to the given field indices.
+    Null attributes become None, non-numeric attributes are converted to
+    strings. Yields (fields, ids, columns) for batches of up to size
+    features, or for all features at once if no size is given. There is
+    always at least one (possibly empty) batch."""
+    fields = layer.fields().toList()
+    indices = range(len(fields)) if attributes == None else list(attributes)
+    fields = [fields[i] for i in indices]
+    numeric = [field.type() in NUMERIC_TYPES for field in fields]
+    ids = []
+    columns = [[] for _ in fields]
+    first = True
+    for feature in features:
+        ids.append(feature.id())
+        values = feature.attributes()
+        for column, i, isNumeric in zip(columns, indices, numeric):
+            value = values[i]
+            if isinstance(value, QPyNullVariant):
+                value = None
+            elif not isNumeric and not isinstance(value, basestring):
+                function = QGISJSONEncoder.lookup(type(value))
+                value = unicode(value if function == None else function(value))
+            column.append(value)
+        if size != None and len(ids) >= size:
+            yield fields, ids, columns
+            first = False
+            ids = []
+            columns = [[] for _ in fields]
+    if ids or first:
+        yield fields, ids, columns
+
+def attributeColumns(layer, features, attributes=None):
+    """Collect the ids and attributes of all given features into columns,
+    see attributeBatches()"""
+    return next(attributeBatches(layer, features, attributes))
+
+# Arrow IPC streams require the optional pyarrow module
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# number of rows per record batch of Arrow streams
+ARROW_BATCH_SIZE = 64 * 1024
+
+class ChunkSink(object):
+    """Writable file object which collects everything written to it until it
+    is drained"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(str(data))
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks = self.chunks
+        self.chunks = []
+        return ''.join(chunks)
+
+def arrowOptions():
+    """Return IPC write options emitting dictionary deltas, or None if this
+    version of pyarrow doesn't support them"""
+    try:
+        return pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    except (AttributeError, TypeError):
+        return None
+
+def toArrow(layer, features, attributes=None):
+    """Encode the attributes of features as an Arrow IPC stream, written one
+    record batch of ARROW_BATCH_SIZE rows at a time. String columns are
+    dictionary encoded, every batch only sending the values which are new to
+    the dictionary (with older versions of pyarrow, which can't write these
+    deltas, strings are written as they are)."""
+    options = arrowOptions()
+    sink = ChunkSink()
+    writer = None
+    # values and their codes of the dictionary of every string column
+    dictionaries = None
+    for fields, ids, columns in attributeBatches(layer, features, attributes, ARROW_BATCH_SIZE):
+        if dictionaries == None:
+            dictionaries = [([], {}) for _ in fields]
+        names = ['$id']
+        arrays = [pyarrow.array(ids, type=pyarrow.int64())]
+        for field, values, (categories, codes) in zip(fields, columns, dictionaries):
+            names.append(field.name())
+            if field.type() in NUMERIC_TYPES:
+                type_ = pyarrow.bool_() if field.type() == QVariant.Bool else getattr(pyarrow, NUMERIC_TYPES[field.type()])()
+                arrays.append(pyarrow.array(values, type=type_))
+            elif options == None:
+                arrays.append(pyarrow.array(values, type=pyarrow.string()))
+            else:
+                indices = []
+                for value in values:
+                    if value != None:
+                        code = codes.get(value)
+                        if code == None:
+                            code = codes[value] = len(categories)
+                            categories.append(value)
+                        value = code
+                    indices.append(value)
+                arrays.append(pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, type=pyarrow.int32()), pyarrow.array(categories, type=pyarrow.string())))
+        batch = pyarrow.RecordBatch.from_arrays(arrays, names)
+
+        if writer == None:
+            if options == None:
+                writer = pyarrow.RecordBatchStreamWriter(pyarrow.PythonFile(sink, mode='w'), batch.schema)
+            else:
+                writer = pyarrow.RecordBatchStreamWriter(pyarrow.PythonFile(sink, mode='w'), batch.schema, options=options)
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# .npz archives require the optional numpy module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def toNpz(layer, features, attributes=None):
+    """Encode the attributes of features as a NumPy .npz archive with one
+    array per column. Null values are recorded in an additional boolean array
+    '<field>.null'. String columns are dictionary encoded: the '<field>' array
+    holds indices into the '<field>.categories' array, -1 standing for null."""
+    fields, ids, columns = attributeColumns(layer, features, attributes)
+    arrays = {'$id': numpy.array(ids, dtype=numpy.int64)}
+    for field, values in zip(fields, columns):
+        name = field.name().encode('utf-8')
+        if field.type() in NUMERIC_TYPES:
+            if None in values:
+                arrays[name + '.null'] = numpy.array([value == None for value in values], dtype=numpy.bool_)
+                values = [0 if value == None else value for value in values]
+            arrays[name] = numpy.array(values, dtype=NUMERIC_TYPES[field.type()])
+        else:
+            codes = {}
+            indices = [-1 if value == None else codes.setdefault(value, len(codes)) for value in values]
+            categories = sorted(codes, key=codes.get)
+            arrays[name] = numpy.array(indices, dtype=numpy.int32)
+            arrays[name + '.categories'] = numpy.array(categories, dtype=unicode)
+    archive = StringIO()
+    numpy.savez(archive, **arrays)
+    yield archive.getvalue()
+
+# binary geometry formats, which can be decoded by clients far more quickly
+# than GeoJSON
+
+def toWKB(_, features, _2=None):
+    """Encode the geometries of features as a sequence of records, each
+    consisting of the feature id (little-endian int64), the length of the
+    geometry (little-endian uint32) and its WKB. Features without a geometry
+    have a length of 0."""
+    chunk = []
+    for feature in features:
+        geometry = feature.geometry()
+        wkb = geometry.asWkb() if geometry != None and not geometry.isEmpty() else ''
+        chunk.append(struct.pack('<qI', feature.id(), len(wkb)))
+        chunk.append(wkb)
+        # the server merges these into larger chunks anyway, but yielding
+        # every single record would mean a lot of generator overhead
+        if len(chunk) >= 1024:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+import os
+import shutil
+from tempfile import mkdtemp
+from qgis.core import QgsFeature, QgsFields, QgsVectorFileWriter
+
+# FlatGeobuf requires a GDAL/OGR build with its driver (GDAL 3.1 or later)
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
+
+def toFlatGeobuf(layer, features, attributes=None):
+    """Encode features (including their attributes, or those with the given
+    field indices) as FlatGeobuf with a packed spatial index. This requires
+    QGIS to be built against GDAL 3.1 or later."""
+    fields = layer.fields()
+    if attributes != None:
+        fields = QgsFields()
+        for i in attributes:
+            fields.append(layer.fields().at(i))
+    # the spatial index is written before the features, so the file can only
+    # be sent once it is complete
+    directory = mkdtemp()
+    try:
+        filename = os.path.join(directory, 'features.fgb')
+        writer = QgsVectorFileWriter(filename, 'utf-8', fields, layer.wkbType(), layer.crs(), 'FlatGeobuf', [], ['SPATIAL_INDEX=YES'])
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise IOError('Could not write FlatGeobuf (requires GDAL 3.1 or later): ' + writer.errorMessage())
+        for feature in features:
+            if attributes != None:
+                # the writer expects the attributes in the order of its fields
+                values = feature.attributes()
+                subset = QgsFeature(fields, feature.id())
+                subset.setGeometry(feature.geometry())
+                subset.setAttributes([values[i] for i in attributes])
+                feature = subset
+            writer.addFeature(feature)
+        # the file is only finished once the writer is deleted
+        del writer
+        with open(filename, 'rb') as fgb:
+            while True:
+                chunk = fgb.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        shutil.rmtree(directory, True)
+
+# formats for the 'format' argument of /qgis/mapLayer/getFeatures: encoding
+# function, content type, and whether it needs the feature geometries and
+# attributes respectively
+FEATURE_FORMATS = OrderedDict()
+if pyarrow != None:
+    FEATURE_FORMATS['arrow'] = (toArrow, 'application/vnd.apache.arrow.stream', False, True)
+if numpy != None:
+    FEATURE_FORMATS['npz'] = (toNpz, 'application/x-npz', False, True)
+FEATURE_FORMATS['wkb'] = (toWKB, 'application/octet-stream', True, False)
+if ogr != None and ogr.GetDriverByName('FlatGeobuf') != None:
+    FEATURE_FORMATS['fgb'] = (toFlatGeobuf, 'application/flatgeobuf', True, True)
@@ -7,9 +7,18 @@
 #
 # the functions should return an instance of NetworkAPIResult
 
-from .registry import networkapi, NetworkAPIResult, parseCRS, toGeoJSON
+from .registry import networkapi, NetworkAPIResult, parseCRS, toGeoJSON, featuresToDicts, QGISJSONEncoder
+from .formats import FEATURE_FORMATS
+from .cache import LRUCache
+from .spatial import containingFeatures, nearestFeatures, resolveFilterRect, simplified
 from distutils.util import strtobool
-from qgis.core import QgsExpression, QgsFeatureRequest, QgsMapLayerRegistry, QgsPoint, QgsRectangle, QgsVectorFileWriter, QgsRasterLayer
+from PyQt4.QtCore import QTimer
+from qgis.core import QgsCoordinateTransform, QgsExpression, QgsExpressionContext, QgsExpressionContextUtils, QgsFeatureRequest, QgsMapLayerRegistry, QgsPoint, QgsRectangle, QgsVectorFileWriter, QgsRasterLayer
+from array import array
+from itertools import islice
+from json import loads
+from uuid import uuid4
+import sys
 import urllib
 
 # TODO add simple function to simplify wrapping argument-free function calls
@@ -49,9 +58,8 @@ def addRasterLayer(iface, request):
     """
     if request.command == 'POST':
         # TODO check get_payload() for multipart?
-        tmpfile, filename = mkstemp()
-        os.write(tmpfile, request.headers.get_payload())
-        os.close(tmpfile)
+        # large bodies are already on disk, otherwise written to a temp file
+        filename = request.save_body()
         return NetworkAPIResult(iface.addRasterLayer(filename, request.args.get('layerName', '')))
     else:
         if request.args.get('rasterLayerPath'):
@@ -142,9 +150,8 @@ def addVectorLayer(iface, request):
     """
     if request.command == 'POST':
         # TODO check get_payload() for multipart?
-        tmpfile, filename = mkstemp()
-        os.write(tmpfile, request.headers.get_payload())
-        os.close(tmpfile)
+        # large bodies are already on disk, otherwise written to a temp file
+        filename = request.save_body()
         # TODO this file should probably not be temporary but actually stay on disk?
     else:
         # try 'vectorLayerPath' GET arg (could actually be file:// or a web http:// url)
@@ -290,12 +297,36 @@ def mapLayer_getFeatures(iface, request):
 
         geometry (optional, default false): if true, returns all feature information including their geometry in GeoJSON format. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
 
+        precision (optional, default 17): number of decimal places of the coordinates in GeoJSON output. With the 'wkb' and 'fgb' formats, coordinates are only rounded if this is given.
+
+        simplify (optional): simplify geometries using the given tolerance (distance). Simplified geometries are cached, so repeated requests with the same tolerance are cheap.
+
+        simplifyUnits (optional, default 'layer'): whether the 'simplify' tolerance is given in 'layer' or 'map' (canvas) units.
+
+        preserveTopology (optional, default true): if false, use a much faster simplification which may produce invalid geometries. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
+
+        fields (optional): comma-separated names of the fields whose attributes should be returned (and read from the data source). If empty, only the feature ids (and geometries) are returned. Defaults to all fields.
+
         orderBy (optional): expression that the results should be ordered by. If you want to order by a field, you'll have to give its name in quotes, e.g. ?orderBy="length"
 
         ascending (optional, default true): whether the results should be listen in ascending or descending order. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
 
         nullsfirst (optional): how null values should be treated in the ordering. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
 
+        format (optional): return the features in a binary format instead, the 'geometry' argument is ignored then. One of:
+            'arrow': ids and attributes column by column as an Arrow IPC stream with dictionary-encoded string columns (requires pyarrow, falls back to 'npz' if it isn't installed)
+            'npz': ids and attributes as a NumPy .npz archive with one array per column (requires numpy)
+            'wkb': ids and geometries as a sequence of records of the feature id (little-endian int64), the length of the geometry in bytes (little-endian uint32) and the geometry as WKB
+            'fgb': complete features as FlatGeobuf, including a packed spatial index (only available if QGIS uses GDAL 3.1 or later)
+
+        limit (optional): maximum number of features to return. If there are (possibly) more features, the response carries a 'Link' header with the URL of the next page (rel="next").
+
+        after (optional): feature id of the last feature of the previous page, only features following it in the requested order are returned. Pages are ordered by feature id unless 'orderBy' is given, in which case ties are broken by feature id.
+
+        afterKey (optional): JSON-encoded value of the 'orderBy' expression for the last feature of the previous page, required together with 'after' and 'orderBy'. Both are filled in by the 'Link' header.
+
+        cursor (optional, default false): together with 'limit', keep the feature iterator open on the server so that further pages continue where the previous one ended instead of being queried anew. The 'Link' header then points to /qgis/mapLayer/getFeatures/cursor. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
+
 
     The different ways to filter features follow the different constructor signatures defined by the QgsFeatureRequest class, in particular:
 
@@ -303,9 +334,11 @@ def mapLayer_getFeatures(iface, request):
 
         If the request is a HTTP GET request, the following query arguments are considered in order, and the first one provided is applied:
 
+            expression (string): Construct a request with a QGIS filter expression, same as the body of a POST request
+
             fid (integer): Construct a request with a QGIS feature ID filter
 
-            rect (string): Construct a request with a rectangle filter. The rectangle should be specified as four numbers in the format "xmin,ymin,xmax,ymax".
+            rect (string): Construct a request with a rectangle filter. The rectangle should be specified as four numbers in the format "xmin,ymin,xmax,ymax". For layers whose data source has no spatial index of its own (memory, delimited text, GeoJSON, ...), the rectangle is looked up in a spatial index kept by the plugin.
 
             A GET request in which none of the arguments are specified returns ALL features of the given vector layer, which can produce very large results.
 
@@ -313,19 +346,226 @@ def mapLayer_getFeatures(iface, request):
     Returns:
         If the 'geometry' argument was passed: a GeoJSON FeatureCollection with complete attribute and geometry data for all features of the layer.
         If the 'geometry' argument was not passed: a list of all features of the vector layer in JSON format, where each feature is an object specifying the feature's 'id' and all its 'attributes'.
+        If the 'format' argument was 'arrow' or 'npz': the feature ids in a column named '$id', followed by one column per field.
+
+        Instead of JSON, the list of features can also be requested as CBOR ('Accept: application/cbor', streamed as an array of indefinite length) or MessagePack ('Accept: application/msgpack', if the msgpack module is installed). MessagePack streams the features as a sequence of separate objects without an enclosing array, so they have to be read with a streaming unpacker.
     """
     layer = qgis_layer_by_id_or_current(iface, request)
+    featurerequest = featureRequest(request)
+    encode, geometry, attributes = featureEncoder(iface, layer, request.args)
+    restrictFeatureRequest(featurerequest, geometry, attributes)
+
+    paginated = request.args.get('limit') or request.args.get('after')
+    if paginated:
+        # stable order
+        featurerequest.addOrderBy('$id')
+    if request.args.get('after'):
+        keyset = keysetFilter(request.args)
+        if featurerequest.filterExpression() != None:
+            keyset = '(' + featurerequest.filterExpression().expression() + ') AND (' + keyset + ')'
+        featurerequest.setFilterExpression(keyset)
+    resolveFilterRect(layer, featurerequest)
+
+    if not paginated:
+        return encode(layer, layer.getFeatures(featurerequest))
+
+    limit = int(request.args.get('limit', 0))
+    if limit and strtobool(request.args.get('cursor', 'n')):
+        token = uuid4().hex
+        cursor = {'layer': layer.id(), 'features': layer.getFeatures(featurerequest), 'args': request.args}
+        cursors.put(token, cursor)
+        cursorTimer.start()
+        return cursorPage(iface, token, cursor, limit)
+
+    if not limit:
+        # all remaining features, no further pages
+        return encode(layer, layer.getFeatures(featurerequest))
+    featurerequest.setLimit(limit)
+
+    # pages are bounded in size, and the last feature has to be known before
+    # sending the response headers
+    page = list(layer.getFeatures(featurerequest))
+    result = encode(layer, (feature for feature in page))
+    if len(page) == limit:
+        args = dict(request.args)
+        if request.command == 'POST':
+            # the link is followed with a GET request
+            args['expression'] = request.headers.get_payload()
+        args['after'] = str(page[-1].id())
+        if request.args.get('orderBy'):
+            context = QgsExpressionContext()
+            context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+            context.setFeature(page[-1])
+            args['afterKey'] = QGISJSONEncoder().encode(QgsExpression(request.args['orderBy']).evaluate(context))
+        result.headers['Link'] = '<' + request.path + '?' + urllib.urlencode(args) + '>; rel="next"'
+    return result
+
+def featureEncoder(iface, layer, args):
+    """Determine how the features of a getFeatures request are returned
+    according to its 'format', 'geometry' and 'fields' arguments. Returns a
+    function turning the features of the layer into a NetworkAPIResult,
+    whether it requires the feature geometries, and the indices of the
+    attributes it requires (None for all of them)."""
+    attributes = None
+    if 'fields' in args:
+        attributes = fieldIndices(layer, args['fields'])
+
+    if args.get('format'):
+        name = args['format']
+        if name == 'arrow' and name not in FEATURE_FORMATS:
+            name = 'npz'
+        if name not in FEATURE_FORMATS:
+            raise ValueError('Unsupported format for getFeatures: ' + args['format'] + ' (available: ' + ', '.join(FEATURE_FORMATS) + ')')
+        encode, content_type, geometry, needsAttributes = FEATURE_FORMATS[name]
+        if not needsAttributes:
+            attributes = []
+        if geometry:
+            # binary geometries are only rounded when asked to
+            simplify = geometrySimplifier(iface, layer, args, args.get('precision'))
+            return lambda layer, features: NetworkAPIResult(encode(layer, simplify(features), attributes), content_type), geometry, attributes
+        return lambda layer, features: NetworkAPIResult(encode(layer, features, attributes), content_type), geometry, attributes
+
+    if strtobool(args.get('geometry', 'n')):
+        precision = int(args.get('precision', 17))
+        simplify = geometrySimplifier(iface, layer, args)
+        return lambda layer, features: NetworkAPIResult(toGeoJSON(layer, simplify(features), precision, attributes), 'application/geo+json; charset=utf-8'), True, attributes
+
+    if attributes != None:
+        return lambda layer, features: NetworkAPIResult(featuresToDicts(layer, features, attributes)), False, attributes
+    # the lazy QgsFeatureIterator (or generator) is converted to JSON (and
+    # sent to the client) one feature at a time
+    return lambda _, features: NetworkAPIResult(features), False, None
+
+def geometrySimplifier(iface, layer, args, precision=None):
+    """Return a function simplifying the geometries of features according to
+    the 'simplify', 'simplifyUnits' and 'preserveTopology' arguments of a
+    request, and optionally rounding their coordinates to the given number of
+    decimal places"""
+    tolerance = float(args.get('simplify', 0))
+    if precision != None:
+        precision = int(precision)
+    if tolerance <= 0 and precision == None:
+        return lambda features: features
+    if args.get('simplifyUnits', 'layer') == 'map':
+        tolerance = tolerance / iface.mapCanvas().mapSettings().layerToMapUnits(layer)
+    preserveTopology = strtobool(args.get('preserveTopology', 'y'))
+    return lambda features: simplified(layer, features, tolerance, preserveTopology, precision)
+
+def fieldIndices(layer, names):
+    """Look up the indices of a comma-separated list of field names"""
+    indices = []
+    for name in names.split(','):
+        if name.strip():
+            index = layer.fieldNameIndex(name.strip())
+            if index == -1:
+                raise KeyError('No field named ' + name.strip() + ' in layer ' + layer.id())
+            indices.append(index)
+    return indices
+
+def restrictFeatureRequest(featurerequest, geometry, attributes):
+    """Let the provider only fetch the geometries and attributes required"""
+    if not geometry:
+        featurerequest.setFlags(featurerequest.flags() | QgsFeatureRequest.NoGeometry)
+    if attributes != None:
+        featurerequest.setSubsetOfAttributes(attributes)
+    return featurerequest
+
+def keysetFilter(args):
+    """Construct the filter expression selecting the features that follow
+    the one given by the 'after' (and 'afterKey') arguments of a paginated
+    getFeatures request"""
+    after = int(args['after'])
+    if not args.get('orderBy'):
+        return '$id > %d' % after
+
+    key = '(' + args['orderBy'] + ')'
+    comparison = '>' if strtobool(args.get('ascending', 'y')) else '<'
+    nullsfirst = strtobool(args.get('nullsfirst', 'n'))
+    value = loads(args['afterKey']) if args.get('afterKey') else None
+    if value == None:
+        # the previous page ended within the features with null keys
+        expression = '(%s IS NULL AND $id > %d)' % (key, after)
+        if nullsfirst:
+            expression = expression + ' OR %s IS NOT NULL' % key
+    else:
+        value = QgsExpression.quotedValue(value)
+        expression = '%s %s %s OR (%s = %s AND $id > %d)' % (key, comparison, value, key, value, after)
+        if not nullsfirst:
+            expression = expression + ' OR %s IS NULL' % key
+    return expression
+
+# feature iterators kept open for paginated requests, closed when they expire
+# or the maximum number of open cursors is exceeded
+CURSOR_TTL = 300
+MAX_CURSORS = 32
+cursors = LRUCache(MAX_CURSORS, CURSOR_TTL, evicted=lambda _, cursor: cursor['features'].close())
+
+def expireCursors():
+    # called periodically while cursors are open, so that the feature
+    # iterators of cursors that are no longer used are closed even if no
+    # further requests arrive
+    if not len(cursors):
+        cursorTimer.stop()
+
+cursorTimer = QTimer()
+cursorTimer.setInterval(CURSOR_TTL * 1000 / 10)
+cursorTimer.timeout.connect(expireCursors)
+
+def cursorPage(iface, token, cursor, limit):
+    """Return the next page of features from a cursor"""
+    layer = qgis_layer_by_id(cursor['layer'])
+    page = list(islice(cursor['features'], limit))
+    encode, _, _2 = featureEncoder(iface, layer, cursor['args'])
+    result = encode(layer, (feature for feature in page))
+    if len(page) == limit:
+        result.headers['Link'] = '</qgis/mapLayer/getFeatures/cursor?' + urllib.urlencode({'token': token, 'limit': limit}) + '>; rel="next"'
+    else:
+        # all features have been retrieved
+        cursors.pop(token)
+        cursor['features'].close()
+    return result
+
+@networkapi('/qgis/mapLayer/getFeatures/cursor')
+def mapLayer_getFeatures_cursor(iface, request):
+    """
+    Return the next page of features from a cursor opened by /qgis/mapLayer/getFeatures.
+
+    Cursors expire when they haven't been used for five minutes, or when too many cursors are open at the same time. They are closed automatically after their last page has been retrieved.
+
+    HTTP query arguments:
+        token (string): the cursor token given in the 'Link' header of the previous page
 
-    # construct and run QgsFeatureRequest depending on arguments
+        limit (optional): maximum number of features to return, defaults to the limit of the request that opened the cursor
 
+        close (optional, default false): close the cursor without returning any more features. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
+
+    Returns:
+        The next page of features in the format requested when opening the cursor, with a 'Link' header pointing to the next page unless there are no more features.
+    """
+    cursor = cursors.get(request.args['token'])
+    if cursor == None:
+        return NetworkAPIResult('Unknown or expired cursor: ' + request.args['token'], 'text/plain', 404)
+    if strtobool(request.args.get('close', 'n')):
+        cursors.pop(request.args['token'])
+        cursor['features'].close()
+        return NetworkAPIResult()
+    return cursorPage(iface, request.args['token'], cursor, int(request.args.get('limit', cursor['args']['limit'])))
+
+def featureRequest(request):
+    """Construct a QgsFeatureRequest from the filter and ordering arguments
+    of a /qgis/mapLayer/getFeatures request"""
     featurerequest = QgsFeatureRequest()
-    featurerequest.addOrderBy(request.args.get('orderBy', ''), strtobool(request.args.get('ascending', 'y')), strtobool(request.args.get('nullsfirst', 'n')))
+    if request.args.get('orderBy'):
+        featurerequest.addOrderBy(request.args['orderBy'], strtobool(request.args.get('ascending', 'y')), strtobool(request.args.get('nullsfirst', 'n')))
 
     if request.command == 'POST':
         # POST request: complex QgsExpression passed as string
         featurerequest.setFilterExpression(QgsExpression(request.headers.get_payload()))
     else:
-        if request.args.get('fid'):
+        if request.args.get('expression'):
+            # same as the body of a POST request, e.g. in 'next' page links
+            featurerequest.setFilterExpression(QgsExpression(request.args['expression']))
+        elif request.args.get('fid'):
             # query by feature id
             featurerequest.setFilterFid(int(request.args['fid']))
         elif request.args.get('rect'):
@@ -335,14 +575,52 @@ def mapLayer_getFeatures(iface, request):
                 raise ValueError('"rect" argument to getFeatures requires exactly four floats in the format "xmin,ymin,xmax,ymax"')
             featurerequest.setFilterRect(QgsRectangle(r[0], r[1], r[2], r[3]))
 
-    result = layer.getFeatures(featurerequest)
+    return featurerequest
+
+@networkapi('/qgis/mapLayer/locate')
+def mapLayer_locate(iface, request):
+    """
+    Find the features of a vector layer nearest to, or containing, many points at once.
+
+    The points are passed in the body of a POST request, either as a JSON array of [x, y] pairs (in which case the request MUST specify 'Content-Type: application/json' in its header), or as consecutive x and y coordinates encoded as little-endian 64 bit floats.
+
+    Queries are answered from a spatial index and prepared geometries which are kept by the plugin until the layer changes.
+
+    HTTP query arguments:
+        id (optional): ID of layer whose features should be located. If not specified, defaults to the currently active layer.
+
+        mode (optional, default 'nearest'): either 'nearest' to find the nearest features to each point, or 'contains' to find the polygon containing each point.
+
+        k (optional, default 1): number of nearest features to return for each point.
 
-    if strtobool(request.args.get('geometry', 'n')):
-        return NetworkAPIResult(toGeoJSON(layer, result), 'application/geo+json; charset=utf-8')
+        crs (optional): coordinate reference system of the points, defaults to the layer's.
+
+    Returns:
+        A list with one entry per point: a list of the ids of the k nearest features (nearest first), or the id of the containing feature (null if there is none).
+    """
+    layer = qgis_layer_by_id_or_current(iface, request)
+    if request.command != 'POST':
+        raise ValueError('The points to locate have to be passed in the body of a POST request')
+
+    coordinates = request.headers.get_payload()
+    if isinstance(coordinates, basestring):
+        coordinates = array('d', coordinates)
+        if sys.byteorder == 'big':
+            coordinates.byteswap()
+        points = [QgsPoint(coordinates[i], coordinates[i + 1]) for i in range(0, len(coordinates) - 1, 2)]
     else:
-        # note that the lazy QgsFeatureIterator returned here is currently
-        # turned into a full in-memory list during conversion to JSON
-        return NetworkAPIResult(result)
+        points = [QgsPoint(x, y) for x, y in coordinates]
+
+    if request.args.get('crs'):
+        transform = QgsCoordinateTransform(parseCRS(request.args['crs']), layer.crs())
+        points = [transform.transform(point) for point in points]
+
+    mode = request.args.get('mode', 'nearest')
+    if mode == 'nearest':
+        return NetworkAPIResult(nearestFeatures(layer, points, int(request.args.get('k', 1))))
+    elif mode == 'contains':
+        return NetworkAPIResult(containingFeatures(layer, points))
+    raise ValueError('Unknown mode for locate: ' + mode)
 
 @networkapi('/qgis/mapLayer/selectedFeatureCount')
 def mapLayer_selectedFeatureCount(iface, request):
@@ -370,14 +648,18 @@ def mapLayer_selectedFeatures(iface, request):
 
     HTTP query arguments:
         id (optional): ID of layer from which selected features should be retrieved. If not specified, defaults to the currently active layer.
+        fields (optional): comma-separated names of the fields whose attributes should be returned. Defaults to all fields.
 
     Returns:
         A list of all currently selected features in JSON format, where each feature is an object specifying the feature's 'id' and all its 'attributes'.
     """
     layer = qgis_layer_by_id_or_current(iface, request)
-    # FIXME this sometimes returns empty attributes and id of 0 for some
-    # elements, maybe retrieve features via their id instead?
-    return NetworkAPIResult(layer.selectedFeatures())
+    attributes = fieldIndices(layer, request.args['fields']) if 'fields' in request.args else None
+    # retrieve features via their id, converted to JSON one at a time
+    features = layer.selectedFeaturesIterator(restrictFeatureRequest(QgsFeatureRequest(), False, attributes))
+    if attributes != None:
+        return NetworkAPIResult(featuresToDicts(layer, features, attributes))
+    return NetworkAPIResult(features)
 
 @networkapi('/qgis/mapLayer/selectedFeatures/geometry')
 def mapLayer_selectedFeatures_geometry(iface, request):
@@ -388,12 +670,18 @@ def mapLayer_selectedFeatures_geometry(iface, request):
 
     HTTP query arguments:
         id (optional): ID of layer from which selected features should be retrieved. If not specified, defaults to the currently active layer.
+        precision (optional, default 17): number of decimal places of the coordinates.
+        simplify, simplifyUnits, preserveTopology (optional): simplify geometries, see /qgis/mapLayer/getFeatures
+        fields (optional): comma-separated names of the fields whose attributes should be included in the properties. Defaults to all fields.
 
     Returns:
         A GeoJSON FeatureCollection with complete data of all selected features of the given vector layer.
     """
     layer = qgis_layer_by_id_or_current(iface, request)
-    return NetworkAPIResult(toGeoJSON(layer, layer.selectedFeatures()), 'application/geo+json; charset=utf-8')
+    attributes = fieldIndices(layer, request.args['fields']) if 'fields' in request.args else None
+    features = layer.selectedFeaturesIterator(restrictFeatureRequest(QgsFeatureRequest(), True, attributes))
+    features = geometrySimplifier(iface, layer, request.args)(features)
+    return NetworkAPIResult(toGeoJSON(layer, features, int(request.args.get('precision', 17)), attributes), 'application/geo+json; charset=utf-8')
 
 @networkapi('/qgis/mapLayer/setAttribution')
 def mapLayer_setAttribution(iface, request):
@@ -546,43 +834,54 @@ def mapCanvas_saveAsImage(iface, request):
         format (optional): any image format string supported by QGIS' (default: 'png', other options e.g. 'jpeg')
 
     Returns:
-        An image the same size as the currently visible map canvas. The content-type of the response is set to 'image/' + format.
+        An image the same size as the currently visible map canvas. The content-type of the response is set to 'image/' + format. Images are cached until the canvas settings or one of its layers change, and are sent with an ETag header: requests with a matching If-None-Match header get an empty '304 Not Modified' response.
     """
+    # imported here because functions_render depends on this module
+    from .functions_render import cachedImage, renderedImages
+
     ext = request.args.get('format', 'png')
-    tmpfile, tmpfilename = mkstemp('.' + ext)
-    os.close(tmpfile)
-
-    # if either is unspecified or otherwise invalid, QGIS display size is used
-    pixmap = QPixmap(int(request.args.get('width', 0)), int(request.args.get('height', 0)))
-    if pixmap.isNull():
-        pixmap = None
-
-    # if the canvas has been modified very recently, it might not be done
-    # re-rendering yet... current fix (from QGIS 3 we could simply use:
-    # iface.mapCanvas().waitWhileRendering()
-    loop = QEventLoop()
-    iface.mapCanvas().mapCanvasRefreshed.connect(loop.quit)
-    # trigger repaint
-    iface.mapCanvas().refresh() # could use refreshAllLayers() to empty cache too
-    # wait
-    loop.exec_()
-    # all good
-    iface.mapCanvas().mapCanvasRefreshed.disconnect(loop.quit)
-
-    # doesn't provide status information about success of writing, have to
-    # check file size below
-    iface.mapCanvas().saveAsImage(tmpfilename, pixmap, ext)
-
-    with open(tmpfilename, 'r') as content_file:
-        imagedata = content_file.read()
-    os.remove(tmpfilename)
-    # TODO QGIS also writes a 'world file' (same filename + 'w' at the end)?
-
-    if len(imagedata) == 0:
-        raise IOError('Failed to write canvas contents in format ' + ext)
+    width = int(request.args.get('width', 0))
+    height = int(request.args.get('height', 0))
+
+    def render():
+        tmpfile, tmpfilename = mkstemp('.' + ext)
+        os.close(tmpfile)
 
+        # if either is unspecified or otherwise invalid, QGIS display size is used
+        pixmap = QPixmap(width, height)
+        if pixmap.isNull():
+            pixmap = None
+
+        # if the canvas has been modified very recently, it might not be done
+        # re-rendering yet... current fix (from QGIS 3 we could simply use:
+        # iface.mapCanvas().waitWhileRendering()
+        loop = QEventLoop()
+        iface.mapCanvas().mapCanvasRefreshed.connect(loop.quit)
+        # trigger repaint
+        iface.mapCanvas().refresh() # could use refreshAllLayers() to empty cache too
+        # wait
+        loop.exec_()
+        # all good
+        iface.mapCanvas().mapCanvasRefreshed.disconnect(loop.quit)
+
+        # doesn't provide status information about success of writing, have to
+        # check file size below
+        iface.mapCanvas().saveAsImage(tmpfilename, pixmap, ext)
+
+        with open(tmpfilename, 'r') as content_file:
+            imagedata = content_file.read()
+        os.remove(tmpfilename)
+        # TODO QGIS also writes a 'world file' (same filename + 'w' at the end)?
+
+        if len(imagedata) == 0:
+            raise IOError('Failed to write canvas contents in format ' + ext)
+        return imagedata
+
+    # the canvas is only refreshed and saved if no image of its current
+    # state was cached
+    key = renderedImages().key(iface.mapCanvas().mapSettings(), 'canvas', ext, width, height)
     # FIXME format = 'jpg' generates image correctly but has incorrect MIMEtype
-    return NetworkAPIResult(imagedata, content_type='image/' + ext.lower())
+    return cachedImage(key, 'image/' + ext.lower(), request, render)
 
 @networkapi('/qgis/mapCanvas/center')
 def mapCanvas_center(iface, _):
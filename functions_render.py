@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+# network api functions to be added to the call path registry
+#
+# the functions should take two arguments: the first is the 'iface' variable
+# which gives access to QGIS components, the second a NetworkAPIRequest object.
+#
+# the functions should return an instance of NetworkAPIResult
+
+from .functions import qgis_layer_by_id
+from .functions_style import styleHash, styleListeners
+from .registry import networkapi, NetworkAPIResult, ResponseStream, parseCRS
+from .cache import LRUCache, renderListeners, renderVersion, sourceStamp
+from network_api_dialog import NetworkAPIDialog
+from distutils.util import strtobool
+from uuid import uuid4
+import hashlib
+import zipfile
+
+from PyQt4.QtCore import QBuffer, QByteArray, QEventLoop, QIODevice, QObject, QSize, QThread, Qt
+from PyQt4.QtGui import QColor
+from qgis.core import QgsCoordinateTransform, QgsMapLayerRegistry, QgsMapRendererParallelJob, QgsMapSettings, QgsRectangle
+
+# content types of the supported image formats
+IMAGE_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg'
+}
+
+def mapSettings(iface, args):
+    """Construct map settings for offscreen rendering from the arguments of a
+    request, defaulting to those of the map canvas"""
+    canvas = iface.mapCanvas().mapSettings()
+    settings = QgsMapSettings()
+    settings.setFlags(canvas.flags())
+
+    size = canvas.outputSize()
+    settings.setOutputSize(QSize(int(args.get('width', size.width())), int(args.get('height', size.height()))))
+    settings.setOutputDpi(float(args.get('dpi', canvas.outputDpi())))
+
+    if args.get('crs'):
+        settings.setDestinationCrs(parseCRS(args['crs']))
+        settings.setCrsTransformEnabled(True)
+    else:
+        settings.setDestinationCrs(canvas.destinationCrs())
+        settings.setCrsTransformEnabled(canvas.hasCrsTransformEnabled())
+
+    if args.get('layers'):
+        # check that all of the layers exist
+        settings.setLayers([qgis_layer_by_id(id).id() for id in args['layers'].split(',')])
+    else:
+        settings.setLayers(canvas.layers())
+
+    if args.get('extent'):
+        r = [float(x) for x in args['extent'].split(',')]
+        if len(r) != 4:
+            raise ValueError('"extent" argument requires exactly four floats in the format "xmin,ymin,xmax,ymax"')
+        settings.setExtent(QgsRectangle(r[0], r[1], r[2], r[3]))
+    elif settings.destinationCrs() != canvas.destinationCrs():
+        # the canvas extent is given in the coordinates of the canvas CRS
+        settings.setExtent(QgsCoordinateTransform(canvas.destinationCrs(), settings.destinationCrs()).transformBoundingBox(canvas.extent()))
+    else:
+        settings.setExtent(canvas.extent())
+
+    if args.get('center'):
+        c = [float(x) for x in args['center'].split(',')]
+        if len(c) != 2:
+            raise ValueError('"center" argument requires exactly two floats in the format "x,y"')
+        extent = settings.extent()
+        settings.setExtent(QgsRectangle(c[0] - extent.width() / 2, c[1] - extent.height() / 2, c[0] + extent.width() / 2, c[1] + extent.height() / 2))
+
+    if args.get('scale'):
+        # zoom around the center of the extent
+        extent = settings.extent()
+        extent.scale(float(args['scale']) / settings.scale())
+        settings.setExtent(extent)
+
+    if strtobool(args.get('transparent', 'n')):
+        settings.setBackgroundColor(QColor(Qt.transparent))
+    else:
+        settings.setBackgroundColor(canvas.backgroundColor())
+    return settings
+
+def renderImage(settings):
+    """Render a map offscreen, returning the QImage. Other events (such as
+    incoming requests) keep being processed while waiting for the
+    rendering to finish."""
+    job = QgsMapRendererParallelJob(settings)
+    loop = QEventLoop()
+    job.finished.connect(loop.quit)
+    job.start()
+    # the job might have finished right away
+    if job.isActive():
+        loop.exec_()
+    return job.renderedImage()
+
+def encodeImage(image, format):
+    """Encode a QImage in the given format, returning the encoded bytes"""
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    if not image.save(buf, format.upper()):
+        raise IOError('Failed to encode image as ' + format)
+    buf.close()
+    return str(data)
+
+class ImageCache(object):
+    """Cache of encoded map images, keyed by (layer ids, hash) where the hash
+    identifies the map settings the image was rendered with, including the
+    style, render version and source stamp of every layer (the hash is also
+    used as the image's ETag, so it has to differ between sessions). Images
+    showing a layer are removed once the layer or its style changes, or it is
+    repainted."""
+
+    def __init__(self):
+        self.images = LRUCache(NetworkAPIDialog.settings.render_cache_memory(), sizeof=len)
+
+    def key(self, settings, *extra):
+        """Return the cache key for an image rendered with the given map
+        settings, and any other arguments affecting the image"""
+        ids = tuple(settings.layers())
+        registry = QgsMapLayerRegistry.instance()
+        extent = settings.extent()
+        values = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum(), settings.rotation(),
+            settings.outputSize().width(), settings.outputSize().height(), settings.outputDpi(),
+            settings.destinationCrs().toProj4(), settings.hasCrsTransformEnabled(), settings.backgroundColor().rgba(), int(settings.flags())]
+        values.extend(extra)
+        for id in ids:
+            layer = registry.mapLayer(id)
+            values.extend([id, styleHash(layer), renderVersion(layer), sourceStamp(layer)])
+        return (ids, hashlib.md5(repr(values)).hexdigest())
+
+    def get(self, key):
+        return self.images.get(key)
+
+    def put(self, key, image):
+        self.images.put(key, image)
+
+    def invalidate(self, id):
+        """Remove all images showing the layer with the given id"""
+        self.images.discard(lambda key: id in key[0])
+
+# created on first use, once the settings are available
+imageCache = None
+
+def renderedImages():
+    global imageCache
+    if imageCache == None:
+        imageCache = ImageCache()
+        styleListeners.append(imageCache.invalidate)
+        renderListeners.append(imageCache.invalidate)
+    return imageCache
+
+def notModified(request, etag):
+    """Check whether the client's copy of a response (as given by the
+    If-None-Match header) has the given entity tag"""
+    tags = request.headers.get('If-None-Match')
+    if not tags:
+        return False
+    # weak comparison, see RFC 7232
+    tags = [tag.strip() for tag in tags.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+def cachedImage(key, content_type, request, render):
+    """Return a response with the image for the given cache key, calling
+    render() to produce the encoded image if it isn't cached. Clients that
+    already have the image get an empty 304 response."""
+    etag = '"' + key[1] + '"'
+    if notModified(request, etag):
+        return NetworkAPIResult(None, content_type, 304, {'ETag': etag})
+    cache = renderedImages()
+    image = cache.get(key)
+    if image == None:
+        image = render()
+        cache.put(key, image)
+    return NetworkAPIResult(image, content_type, headers={'ETag': etag})
+
+@networkapi('/qgis/render')
+def render(iface, request):
+    """
+    Render a map image offscreen.
+
+    Unlike /qgis/mapCanvas/saveAsImage, this does not use (or wait for) the map canvas, so arbitrary extents, sizes and layers can be rendered without affecting what the user sees. Any settings not given are taken from the map canvas.
+
+    HTTP query arguments:
+        extent (optional): extent to render in the format "xmin,ymin,xmax,ymax", in the coordinates of the output CRS
+
+        width, height (optional): size of the image in pixels
+
+        dpi (optional): output resolution, affects the size of symbols and labels
+
+        center (optional): center of the extent in the format "x,y", moving the extent given (or the canvas extent)
+
+        scale (optional): scale denominator to zoom the extent to, keeping its center
+
+        crs (optional): output coordinate reference system
+
+        layers (optional): comma-separated IDs of the layers to render, topmost first
+
+        transparent (optional, default false): render on a transparent instead of the canvas background. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
+
+        format (optional, default 'png'): either 'png' or 'jpeg'
+
+    Returns:
+        The rendered image. Rendered images are cached until one of their layers changes, and are sent with an ETag header: requests with a matching If-None-Match header get an empty '304 Not Modified' response.
+    """
+    format = request.args.get('format', 'png').lower()
+    if format not in IMAGE_TYPES:
+        raise ValueError('Unsupported image format: ' + format + ' (available: ' + ', '.join(sorted(IMAGE_TYPES)) + ')')
+    settings = mapSettings(iface, request.args)
+    return cachedImage(renderedImages().key(settings, IMAGE_TYPES[format]), IMAGE_TYPES[format], request, lambda: encodeImage(renderImage(settings), format))
+
+class BatchRenderer(QObject):
+    """Renders a series of maps offscreen, with up to the given number of jobs
+    running at the same time. Driven by the finished signals of the jobs:
+    rendered(index, QImage) is called as soon as a job has finished, done()
+    once all of them have."""
+
+    def __init__(self, settings, concurrency, rendered, done):
+        QObject.__init__(self)
+        self.pending = list(enumerate(settings))
+        self.concurrency = concurrency
+        self.rendered = rendered
+        self.done = done
+        self.running = {}
+
+    def start(self):
+        while self.pending and len(self.running) < self.concurrency:
+            index, settings = self.pending.pop(0)
+            job = QgsMapRendererParallelJob(settings)
+            # owned by the renderer until deleted below
+            job.setParent(self)
+            job.finished.connect(lambda index=index: self.finished(index))
+            self.running[index] = job
+            job.start()
+
+    def finished(self, index):
+        job = self.running.pop(index, None)
+        if job == None:
+            # cancelled
+            return
+        # can't be deleted while its finished signal is being emitted
+        job.deleteLater()
+        self.rendered(index, job.renderedImage())
+        # jobs might finish right away, calling this recursively
+        self.start()
+        if not self.running and not self.pending and self.done != None:
+            done = self.done
+            self.done = None
+            done()
+
+    def cancel(self):
+        self.pending = []
+        running = self.running
+        self.running = {}
+        for job in running.values():
+            job.cancel()
+            job.deleteLater()
+
+class MultipartWriter(object):
+    """Writes images to a stream as the parts of a multipart/mixed body"""
+
+    def __init__(self, stream, format):
+        self.stream = stream
+        self.format = format
+        self.boundary = uuid4().hex
+        self.content_type = 'multipart/mixed; boundary=' + self.boundary
+
+    def add(self, index, data):
+        self.stream.write('--' + self.boundary + '\r\nContent-Type: ' + IMAGE_TYPES[self.format] + '\r\nContent-Disposition: inline; filename="' + str(index) + '.' + self.format + '"\r\n\r\n' + data + '\r\n')
+
+    def close(self):
+        self.stream.write('--' + self.boundary + '--\r\n')
+
+class ZipWriter(object):
+    """Writes images to a stream as the entries of a zip archive"""
+
+    content_type = 'application/zip'
+
+    def __init__(self, stream, format):
+        self.format = format
+        # images are compressed already
+        self.archive = zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED)
+
+    def add(self, index, data):
+        self.archive.writestr(str(index) + '.' + self.format, data)
+
+    def close(self):
+        self.archive.close()
+
+# writers for the supported containers of batch rendering results
+CONTAINERS = {
+    'multipart': MultipartWriter,
+    'zip': ZipWriter
+}
+
+@networkapi('/qgis/render/batch')
+def render_batch(iface, request):
+    """
+    Render a series of map images offscreen, several at a time.
+
+    The maps to render are passed as a JSON list in the body of a POST request (with 'Content-Type: application/json'). Every element is an object with any of the arguments of /qgis/render (extent, center, scale, width, height, dpi, crs, layers, transparent), given either as strings or, for extent and center, as lists of numbers. Arguments passed in the query string apply to all of the maps.
+
+    The images are returned as they finish rendering, which is not necessarily the order in which they were requested.
+
+    HTTP query arguments:
+        format (optional, default 'png'): either 'png' or 'jpeg'
+
+        container (optional, default 'multipart'): either 'multipart' (a multipart/mixed response) or 'zip'
+
+        concurrency (optional): maximum number of maps rendered at the same time, defaults to the number of processor cores
+
+    Returns:
+        A multipart or zip stream of the rendered images. Each image is named after the position of its map in the list, e.g. '0.png', '1.png', ...
+    """
+    if request.command != 'POST' or not isinstance(request.headers.get_payload(), list):
+        raise ValueError('The maps to render have to be passed as a JSON list in the body of a POST request')
+    format = request.args.get('format', 'png').lower()
+    if format not in IMAGE_TYPES:
+        raise ValueError('Unsupported image format: ' + format + ' (available: ' + ', '.join(sorted(IMAGE_TYPES)) + ')')
+    container = request.args.get('container', 'multipart')
+    if container not in CONTAINERS:
+        raise ValueError('Unknown container: ' + container + ' (available: ' + ', '.join(sorted(CONTAINERS)) + ')')
+    concurrency = max(1, int(request.args.get('concurrency', QThread.idealThreadCount())))
+
+    # construct all map settings first, so that invalid arguments are
+    # reported before anything is rendered
+    settings = []
+    for entry in request.headers.get_payload():
+        args = dict(request.args)
+        for name, value in entry.iteritems():
+            args[name] = ','.join(str(v) for v in value) if isinstance(value, list) else str(value)
+        settings.append(mapSettings(iface, args))
+
+    # images are written to the response as their jobs finish, rather than
+    # waiting for them while the response is sent
+    stream = ResponseStream()
+    writer = CONTAINERS[container](stream, format)
+
+    def rendered(index, image):
+        try:
+            writer.add(index, encodeImage(image, format))
+        except Exception as e:
+            renderer.cancel()
+            stream.fail(e)
+
+    def done():
+        if not stream.finished:
+            writer.close()
+            stream.finish()
+
+    renderer = BatchRenderer(settings, concurrency, rendered, done)
+    # jobs still running when the client goes away are cancelled
+    stream.closed.connect(renderer.cancel)
+    stream.renderer = renderer
+    renderer.start()
+    return NetworkAPIResult(stream, writer.content_type)
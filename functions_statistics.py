@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+# network api functions to be added to the call path registry
+#
+# the functions should take two arguments: the first is the 'iface' variable
+# which gives access to QGIS components, the second a NetworkAPIRequest object.
+#
+# the functions should return an instance of NetworkAPIResult
+
+from .functions import featureRequest, fieldIndices, qgis_layer_by_id_or_current, restrictFeatureRequest
+from .registry import networkapi, NetworkAPIResult, plainValue
+from .cache import LRUCache, layerCache, layerVersion
+from .spatial import resolveFilterRect
+
+from qgis.core import QgsFeatureRequest
+from collections import OrderedDict
+from distutils.util import strtobool
+from json import dumps
+import math
+
+# aggregate functions as (initial state, function adding a value to the
+# state, function computing the result from the final state). null values
+# are never passed to them
+AGGREGATE_FUNCTIONS = {
+    'count': (lambda: 0, lambda n, _: n + 1, lambda n: n),
+    'sum': (lambda: 0, lambda total, value: total + value, lambda total: total),
+    'min': (lambda: None, lambda m, value: value if m == None or value < m else m, lambda m: m),
+    'max': (lambda: None, lambda m, value: value if m == None or value > m else m, lambda m: m),
+    'mean': (lambda: (0, 0), lambda (total, n), value: (total + value, n + 1), lambda (total, n): float(total) / n if n else None)
+}
+
+def percentile(values, q):
+    """Compute the q-th percentile of a list of values, interpolating linearly
+    between the closest ranks"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def aggregateFunction(name):
+    """Look up an aggregate function by name, including percentiles given as
+    'p' followed by a number (e.g. p50, p90, p99.9)"""
+    if name in AGGREGATE_FUNCTIONS:
+        return AGGREGATE_FUNCTIONS[name]
+    if name.startswith('p'):
+        try:
+            q = float(name[1:])
+        except ValueError:
+            q = -1
+        if 0 <= q <= 100:
+            # all values have to be kept
+            return (list, lambda values, value: values.append(value) or values, lambda values: percentile(values, q))
+    raise ValueError('Unknown aggregate function: ' + name + ' (available: ' + ', '.join(sorted(AGGREGATE_FUNCTIONS)) + ', p0-p100)')
+
+# aggregation results by (layer id, layer version, arguments of the request)
+MAX_AGGREGATE_RESULTS = 64
+aggregateResults = layerCache(LRUCache(MAX_AGGREGATE_RESULTS))
+
+@networkapi('/qgis/mapLayer/aggregate')
+def mapLayer_aggregate(iface, request):
+    """
+    Compute aggregate values over (groups of) features of the given vector layer.
+
+    Features are selected in the same way as by /qgis/mapLayer/getFeatures, i.e. by a QGIS filter expression in the body of a POST request, or by the 'expression', 'fid' or 'rect' arguments of a GET request. Only the attributes required are read, in a single pass over the features. Results are cached until the layer's data changes.
+
+    HTTP query arguments:
+        id (optional): ID of layer whose features should be aggregated. If not specified, defaults to the currently active layer.
+
+        groupBy (optional): comma-separated names of the fields to group the features by. If not specified, all features form a single group.
+
+        aggregates (optional, default 'count'): comma-separated list of aggregates to compute for each group, either 'count' (number of features) or 'function:field' with one of the functions count (number of non-null values), sum, mean, min, max, or a percentile such as p50 or p90. Null values are ignored.
+
+        expression, fid, rect (optional): filter the features, see /qgis/mapLayer/getFeatures
+
+    Returns:
+        A list of objects, one per group (sorted by the values of the 'groupBy' fields), containing the values of the 'groupBy' fields and each aggregate under the name it was requested by.
+    """
+    layer = qgis_layer_by_id_or_current(iface, request)
+    groupBy = [name.strip() for name in request.args.get('groupBy', '').split(',') if name.strip()]
+    specs = [spec.strip() for spec in request.args.get('aggregates', 'count').split(',') if spec.strip()]
+
+    payload = request.headers.get_payload() if request.command == 'POST' else None
+    if not isinstance(payload, (basestring, type(None))):
+        # parsed JSON body, not hashable
+        payload = dumps(payload, sort_keys=True)
+    key = (layer.id(), layerVersion(layer), request.command, payload, tuple(groupBy), tuple(specs), request.args.get('expression'), request.args.get('fid'), request.args.get('rect'))
+    rows = aggregateResults.get(key)
+    if rows != None:
+        return NetworkAPIResult(rows)
+
+    groupIndices = fieldIndices(layer, ','.join(groupBy))
+    # aggregates as (index of field or None, aggregate function)
+    aggregates = []
+    for spec in specs:
+        name, _, field = spec.partition(':')
+        function = aggregateFunction(name)
+        if not field.strip():
+            if name != 'count':
+                raise ValueError('Aggregate ' + name + ' requires a field, e.g. ' + name + ':fieldname')
+            aggregates.append((None, function))
+        else:
+            aggregates.append((fieldIndices(layer, field)[0], function))
+
+    featurerequest = featureRequest(request)
+    restrictFeatureRequest(featurerequest, False, sorted(set(groupIndices + [index for index, _ in aggregates if index != None])))
+    resolveFilterRect(layer, featurerequest)
+
+    groups = {}
+    for feature in layer.getFeatures(featurerequest):
+        values = feature.attributes()
+        group = tuple(plainValue(values[i]) for i in groupIndices)
+        states = groups.get(group)
+        if states == None:
+            states = groups[group] = [initial() for _, (initial, _2, _3) in aggregates]
+        for i, (index, (_, add, _2)) in enumerate(aggregates):
+            if index == None:
+                states[i] = add(states[i], None)
+            else:
+                value = plainValue(values[index])
+                if value != None:
+                    states[i] = add(states[i], value)
+
+    if not groupBy and not groups:
+        # aggregates over no features at all
+        groups[()] = [initial() for _, (initial, _2, _3) in aggregates]
+
+    rows = []
+    for group in sorted(groups):
+        row = OrderedDict(zip(groupBy, group))
+        for spec, (_, (_2, _3, result)), state in zip(specs, aggregates, groups[group]):
+            row[spec] = result(state)
+        rows.append(row)
+    aggregateResults.put(key, rows)
+    return NetworkAPIResult(rows)
+
+# distinct values and statistics of fields by (layer id, layer version, path,
+# arguments of the request)
+MAX_FIELD_RESULTS = 256
+fieldResults = layerCache(LRUCache(MAX_FIELD_RESULTS))
+
+def fieldValues(layer, index):
+    """Iterate over the values of one field of all features of a layer,
+    reading only that field"""
+    featurerequest = restrictFeatureRequest(QgsFeatureRequest(), False, [index])
+    for feature in layer.getFeatures(featurerequest):
+        yield plainValue(feature.attributes()[index])
+
+@networkapi('/qgis/mapLayer/fields/uniqueValues')
+def mapLayer_fields_uniqueValues(iface, request):
+    """
+    Return the distinct values of a field of the given vector layer.
+
+    Without counts, the distinct values are retrieved from the data provider, which can usually compute them without reading all features. Results are cached until the layer's data changes.
+
+    HTTP query arguments:
+        id (optional): ID of the layer. If not specified, defaults to the currently active layer.
+
+        field (string): name of the field
+
+        limit (optional): maximum number of values to return
+
+        counts (optional, default false): also count how often each value occurs. Accepts several string representations of booleans (e.g. 1, 0, true, false, yes, no, ...).
+
+    Returns:
+        A list of the distinct values, or, if counts were requested, a list of objects with the 'value' and its 'count', the most frequent values first.
+    """
+    layer = qgis_layer_by_id_or_current(iface, request)
+    index = fieldIndices(layer, request.args['field'])[0]
+    limit = int(request.args.get('limit', -1))
+    counts = strtobool(request.args.get('counts', 'n'))
+
+    key = (layer.id(), layerVersion(layer), request.path, index, limit, counts)
+    result = fieldResults.get(key)
+    if result == None:
+        if counts:
+            frequencies = {}
+            for value in fieldValues(layer, index):
+                frequencies[value] = frequencies.get(value, 0) + 1
+            result = [{'value': value, 'count': count} for value, count in sorted(frequencies.iteritems(), key=lambda (value, count): (-count, value))]
+            if limit >= 0:
+                result = result[:limit]
+        else:
+            result = [plainValue(value) for value in layer.uniqueValues(index, limit)]
+        fieldResults.put(key, result)
+    return NetworkAPIResult(result)
+
+@networkapi('/qgis/mapLayer/fields/statistics')
+def mapLayer_fields_statistics(iface, request):
+    """
+    Return summary statistics of a field of the given vector layer.
+
+    The statistics are computed in a single pass over the values of the field, and cached until the layer's data changes.
+
+    HTTP query arguments:
+        id (optional): ID of the layer. If not specified, defaults to the currently active layer.
+
+        field (string): name of the field
+
+        quantiles (optional, default '25,50,75'): comma-separated list of percentiles to compute
+
+    Returns:
+        An object with the number of non-null values ('count'), of null values ('nulls'), of distinct values ('distinct'), and their 'min' and 'max'. For numeric fields, also their 'sum', 'mean', (population) standard deviation 'stddev', and the requested 'quantiles' as an object mapping each percentile to its value.
+    """
+    layer = qgis_layer_by_id_or_current(iface, request)
+    index = fieldIndices(layer, request.args['field'])[0]
+    quantiles = [float(q) for q in request.args.get('quantiles', '25,50,75').split(',') if q.strip()]
+
+    key = (layer.id(), layerVersion(layer), request.path, index, tuple(quantiles))
+    result = fieldResults.get(key)
+    if result != None:
+        return NetworkAPIResult(result)
+
+    values = []
+    nulls = 0
+    numeric = True
+    # running mean and sum of squared differences (Welford's algorithm)
+    mean = 0.0
+    squares = 0.0
+    for value in fieldValues(layer, index):
+        if value == None:
+            nulls = nulls + 1
+            continue
+        values.append(value)
+        if numeric and (isinstance(value, bool) or not isinstance(value, (int, long, float))):
+            numeric = False
+        if numeric:
+            delta = value - mean
+            mean = mean + delta / len(values)
+            squares = squares + delta * (value - mean)
+
+    result = OrderedDict([('count', len(values)), ('nulls', nulls), ('distinct', len(set(values))), ('min', min(values) if values else None), ('max', max(values) if values else None)])
+    if numeric:
+        result['sum'] = sum(values)
+        result['mean'] = mean if values else None
+        result['stddev'] = math.sqrt(squares / len(values)) if values else None
+        result['quantiles'] = OrderedDict(('%g' % q, percentile(values, q)) for q in quantiles)
+    fieldResults.put(key, result)
+    return NetworkAPIResult(result)
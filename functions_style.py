@@ -9,8 +9,42 @@
 
 from .functions import qgis_layer_by_id
 from .registry import networkapi, NetworkAPIResult, toGeoJSON
+from .cache import removalListeners, trackLayerRemovals
 
 from PyQt4.QtXml import QDomDocument
+import hashlib
+
+# hashes of the style XML of layers, so that things rendered with a given
+# style can be recognised. they are recomputed after the style of a layer was
+# changed through one of the paths below
+styleHashes = {}
+
+# functions called with the id of a layer whenever its style was changed
+# through one of the paths below
+styleListeners = []
+
+def styleXML(layer):
+    """Return the style of a layer as a QDomDocument"""
+    doc = QDomDocument('xml')
+    root = doc.createElement('pipe')
+    doc.appendChild(root)
+    # TODO check return value (although this really shouldn't fail..)
+    layer.writeStyle(root, doc, '')
+    return doc
+
+def styleHash(layer):
+    """Return a hash of the style XML of a layer"""
+    if layer.id() not in styleHashes:
+        trackLayerRemovals()
+        styleHashes[layer.id()] = hashlib.md5(styleXML(layer).toString().encode('utf-8')).hexdigest()
+    return styleHashes[layer.id()]
+
+removalListeners.append(lambda id: styleHashes.pop(id, None))
+
+def styleChanged(layer):
+    styleHashes.pop(layer.id(), None)
+    for listener in styleListeners:
+        listener(layer.id())
 
 # GET/POST overloading for reading/writing style XML
 @networkapi('/qgis/mapLayer/style')
@@ -38,14 +72,10 @@ def mapLayer_style(iface, request):
         # (i.e. if the change was not applied)
         if not doc.setContent(request.headers.get_payload()) or not layer.readStyle(doc, None):
             return NetworkAPIResult(status=NetworkAPIResult.INVALID_ARGUMENTS)
+        styleChanged(layer)
 
-    doc = QDomDocument('xml')
-    root = doc.createElement('pipe')
-    doc.appendChild(root)
-    # TODO check return value (although this really shouldn't fail..)
-    layer.writeStyle(root, doc, '')
     # QDomDocument is automatically processed by server
-    return NetworkAPIResult(doc)
+    return NetworkAPIResult(styleXML(layer))
 
 @networkapi('/qgis/mapLayer/styleURI')
 def mapLayer_styleURI(iface, request):
@@ -66,7 +96,10 @@ def mapLayer_loadDefaultStyle(iface, request):
     Returns:
         A string with any status messages
     """
-    return NetworkAPIResult(qgis_layer_by_id(request.args['id']).loadDefaultStyle(None))
+    layer = qgis_layer_by_id(request.args['id'])
+    result = layer.loadDefaultStyle(None)
+    styleChanged(layer)
+    return NetworkAPIResult(result)
 
 @networkapi('/qgis/mapLayer/loadNamedStyle')
 def mapLayer_loadNamedStyle(iface, request):
@@ -82,7 +115,9 @@ def mapLayer_loadNamedStyle(iface, request):
         A string with any status messages
     """
     layer = qgis_layer_by_id(request.args['id'])
-    return NetworkAPIResult(layer.loadNamedStyle(request.args['uri'], None))
+    result = layer.loadNamedStyle(request.args['uri'], None)
+    styleChanged(layer)
+    return NetworkAPIResult(result)
 
 @networkapi('/qgis/mapLayer/saveNamedStyle')
 def mapLayer_saveNamedStyle(iface, request):
@@ -141,6 +176,7 @@ def mapLayer_renderer(iface, request):
             renderer = class_.create(root.firstChildElement('rasterrenderer'), layer.renderer().input())
             layer.setRenderer(renderer)
 
+        styleChanged(layer)
         layer.triggerRepaint()
 
     # read and return currently set renderer spec
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+# network api functions to be added to the call path registry
+#
+# the functions should take two arguments: the first is the 'iface' variable
+# which gives access to QGIS components, the second a NetworkAPIRequest object.
+#
+# the functions should return an instance of NetworkAPIResult
+
+from .functions import fieldIndices, qgis_layer_by_id
+from .functions_render import encodeImage, renderImage
+from .functions_style import styleHash, styleListeners
+from .registry import networkapi, NetworkAPIResult, plainValue
+from .cache import DiskCache, LRUCache, layerCache, layerVersion, renderListeners, renderVersion, sourceStamp
+from .spatial import simplifyGeometry, spatialIndex
+from . import mvt
+from network_api_dialog import NetworkAPIDialog
+
+from PyQt4.QtCore import QSize, Qt
+from PyQt4.QtGui import QColor
+from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsFeatureRequest, QgsGeometry, QgsMapSettings, QgsRectangle
+from tempfile import gettempdir
+import hashlib
+import os
+
+# web mercator tiling scheme
+TILE_SIZE = 256
+WORLD_EXTENT = 20037508.342789244
+
+# tiles are rendered in blocks of up to METATILE x METATILE tiles, with a
+# margin of BUFFER pixels around them so that labels and symbols crossing
+# tile boundaries are drawn consistently
+METATILE = 4
+BUFFER = 64
+
+class TileCache(object):
+    """Two-level cache of encoded tiles, in memory and on disk. Tiles are
+    keyed by (layer set, z, x, y), where the layer set is a hash identifying
+    the rendered layers including their style and render version."""
+
+    def __init__(self):
+        settings = NetworkAPIDialog.settings
+        self.memory = LRUCache(settings.tile_cache_memory(), sizeof=len)
+        self.disk = None
+        if settings.tile_cache_disk() > 0:
+            directory = settings.tile_cache_directory() or os.path.join(gettempdir(), 'qgis-networkapi-tiles')
+            self.disk = DiskCache(directory, settings.tile_cache_disk())
+        # layer ids by layer set
+        self.layersets = {}
+
+    def layerset(self, layers):
+        key = hashlib.md5(';'.join('%s:%s:%d:%s' % (layer.id(), styleHash(layer), renderVersion(layer), sourceStamp(layer)) for layer in layers).encode('utf-8')).hexdigest()
+        if key not in self.layersets:
+            ids = [layer.id() for layer in layers]
+            # tiles of the same layers in an earlier state (e.g. with files
+            # modified outside of QGIS) won't be requested anymore
+            for layerset in [layerset for layerset in self.layersets if self.layersets[layerset] == ids]:
+                self.discard(layerset)
+            self.layersets[key] = ids
+        return key
+
+    def get(self, layerset, z, x, y):
+        tile = self.memory.get((layerset, z, x, y))
+        if tile == None and self.disk != None:
+            tile = self.disk.get('%s/%d/%d/%d.png' % (layerset, z, x, y))
+            if tile != None:
+                self.memory.put((layerset, z, x, y), tile)
+        return tile
+
+    def put(self, layerset, z, x, y, tile):
+        self.memory.put((layerset, z, x, y), tile)
+        if self.disk != None:
+            self.disk.put('%s/%d/%d/%d.png' % (layerset, z, x, y), tile)
+
+    def invalidate(self, id):
+        """Remove all tiles showing the layer with the given id, and forget
+        the layer sets including it"""
+        for layerset, ids in self.layersets.items():
+            if id in ids:
+                self.discard(layerset)
+
+    def discard(self, layerset):
+        self.memory.discard(lambda key: key[0] == layerset)
+        if self.disk != None:
+            self.disk.discard(lambda key: key.startswith(layerset + '/'))
+        del self.layersets[layerset]
+
+# created on first use, once the settings are available
+tileCache = None
+
+def tileExtent(z, x0, y0, x1, y1):
+    """Return the web mercator extent of a block of tiles"""
+    size = 2 * WORLD_EXTENT / 2 ** z
+    return QgsRectangle(-WORLD_EXTENT + x0 * size, WORLD_EXTENT - y1 * size, -WORLD_EXTENT + x1 * size, WORLD_EXTENT - y0 * size)
+
+def renderMetatile(layers, layerset, z, x, y):
+    """Render the block of tiles containing the given one, storing all of
+    them in the cache. Returns the given tile."""
+    n = min(METATILE, 2 ** z)
+    x0 = x // n * n
+    y0 = y // n * n
+    extent = tileExtent(z, x0, y0, x0 + n, y0 + n)
+    margin = BUFFER * extent.width() / (n * TILE_SIZE)
+
+    settings = QgsMapSettings()
+    settings.setOutputSize(QSize(n * TILE_SIZE + 2 * BUFFER, n * TILE_SIZE + 2 * BUFFER))
+    settings.setOutputDpi(96)
+    settings.setDestinationCrs(QgsCoordinateReferenceSystem('EPSG:3857'))
+    settings.setCrsTransformEnabled(True)
+    settings.setLayers([layer.id() for layer in layers])
+    settings.setExtent(QgsRectangle(extent.xMinimum() - margin, extent.yMinimum() - margin, extent.xMaximum() + margin, extent.yMaximum() + margin))
+    settings.setBackgroundColor(QColor(Qt.transparent))
+    image = renderImage(settings)
+
+    result = None
+    for i in range(n):
+        for j in range(n):
+            tile = encodeImage(image.copy(BUFFER + i * TILE_SIZE, BUFFER + j * TILE_SIZE, TILE_SIZE, TILE_SIZE), 'png')
+            tileCache.put(layerset, z, x0 + i, y0 + j, tile)
+            if (x0 + i, y0 + j) == (x, y):
+                result = tile
+    return result
+
+@networkapi('/tiles/{z}/{x}/{y}.png')
+def tiles(iface, request):
+    """
+    Return a map tile for use with web mapping libraries such as Leaflet or OpenLayers.
+
+    Tiles follow the common XYZ scheme (256x256 pixel tiles in web mercator projection, y counting from the top), so the URL template for the map library is /tiles/{z}/{x}/{y}.png?layers=... (the layers argument being optional).
+
+    Tiles are rendered in blocks and cached in memory and on disk. Cached tiles are discarded when the style or renderer of one of their layers is changed through the Network API, or any of their layers is modified, repainted or removed.
+
+    HTTP query arguments:
+        layers (optional): comma-separated IDs of the layers to render, topmost first. Defaults to the layers shown in the map canvas.
+
+    Returns:
+        A transparent PNG image.
+    """
+    global tileCache
+    if tileCache == None:
+        tileCache = TileCache()
+        styleListeners.append(tileCache.invalidate)
+        renderListeners.append(tileCache.invalidate)
+
+    z = int(request.args['z'])
+    x = int(request.args['x'])
+    y = int(request.args['y'])
+    if not (0 <= z <= 30 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return NetworkAPIResult('No such tile', 'text/plain', 404)
+
+    if request.args.get('layers'):
+        layers = [qgis_layer_by_id(id) for id in request.args['layers'].split(',')]
+    else:
+        layers = iface.mapCanvas().layers()
+    layerset = tileCache.layerset(layers)
+
+    tile = tileCache.get(layerset, z, x, y)
+    if tile == None:
+        tile = renderMetatile(layers, layerset, z, x, y)
+    return NetworkAPIResult(tile, 'image/png')
+
+
+# vector tiles
+
+# margin (in tile coordinates) by which geometries extend beyond the tile, so
+# that lines and polygon outlines don't end right at its edges
+MVT_BUFFER = 64
+
+# encoded vector tiles by (layer id, layer version, fields, z, x, y)
+MVT_CACHE_SIZE = 64 * 1024 * 1024
+vectorTiles = layerCache(LRUCache(MVT_CACHE_SIZE, sizeof=len))
+
+# vector tile geometry types by QGIS geometry type
+MVT_TYPES = {
+    QGis.Point: mvt.POINT,
+    QGis.Line: mvt.LINESTRING,
+    QGis.Polygon: mvt.POLYGON
+}
+
+def encodeVectorTile(layer, attributes, z, x, y):
+    """Clip, simplify and quantize the features of a layer within the given
+    tile, and encode them as a vector tile"""
+    extent = tileExtent(z, x, y, x + 1, y + 1)
+    scale = mvt.EXTENT / extent.width()
+    margin = MVT_BUFFER / scale
+    clip = QgsRectangle(extent.xMinimum() - margin, extent.yMinimum() - margin, extent.xMaximum() + margin, extent.yMaximum() + margin)
+
+    mercator = QgsCoordinateReferenceSystem('EPSG:3857')
+    transform = None
+    rect = clip
+    if layer.crs() != mercator:
+        transform = QgsCoordinateTransform(layer.crs(), mercator)
+        rect = transform.transformBoundingBox(clip, QgsCoordinateTransform.ReverseTransform)
+
+    geometryType = layer.geometryType()
+    if geometryType not in MVT_TYPES:
+        raise ValueError('Layer ' + layer.id() + ' has no geometries')
+    names = [field.name() for field in layer.fields().toList()]
+    if attributes != None:
+        names = [names[i] for i in attributes]
+    encoder = mvt.LayerEncoder(layer.name())
+
+    def quantize(points):
+        # tile coordinates have y pointing down, duplicates are dropped
+        result = []
+        for point in points:
+            p = (int(round((point.x() - extent.xMinimum()) * scale)), int(round((extent.yMaximum() - point.y()) * scale)))
+            if not result or result[-1] != p:
+                result.append(p)
+        return result
+
+    fids = spatialIndex(layer, True).intersects(rect)
+    if not fids:
+        return mvt.encodeTile([encoder])
+    featurerequest = QgsFeatureRequest().setFilterFids(fids)
+    if attributes != None:
+        featurerequest.setSubsetOfAttributes(attributes)
+    clipGeometry = QgsGeometry.fromRect(clip)
+    for feature in layer.getFeatures(featurerequest):
+        geometry = feature.geometry()
+        if geometry == None or geometry.isEmpty():
+            continue
+        geometry = QgsGeometry(geometry)
+        if transform != None:
+            geometry.transform(transform)
+        if geometryType != QGis.Point:
+            # clip, then drop detail below the resolution of the tile (the
+            # fast simplification may produce invalid geometries, which the
+            # intersection wouldn't cope with)
+            geometry = geometry.intersection(clipGeometry)
+            if geometry == None or geometry.isEmpty():
+                continue
+            geometry = simplifyGeometry(geometry, 1 / scale, False, None) or geometry
+
+        commands = mvt.GeometryEncoder()
+        parts = geometry.asGeometryCollection() if geometry.isMultipart() or geometry.type() != geometryType else [geometry]
+        # all points of a multipoint go into a single MoveTo command
+        points = []
+        for part in parts:
+            if part.type() != geometryType:
+                # e.g. points where a polygon touches the clip rectangle
+                continue
+            if geometryType == QGis.Point:
+                points.extend(p for p in quantize([part.asPoint()]) if -MVT_BUFFER <= p[0] <= mvt.EXTENT + MVT_BUFFER and -MVT_BUFFER <= p[1] <= mvt.EXTENT + MVT_BUFFER)
+            elif geometryType == QGis.Line:
+                line = quantize(part.asPolyline())
+                if len(line) >= 2:
+                    commands.addLine(line)
+            else:
+                exterior = True
+                for ring in part.asPolygon():
+                    ring = quantize(ring)
+                    if len(ring) > 1 and ring[0] == ring[-1]:
+                        ring = ring[:-1]
+                    # rings collapsed by the quantization are dropped, along
+                    # with the holes of collapsed exterior rings
+                    if len(ring) >= 3 and mvt.area(ring) != 0:
+                        commands.addRing(ring, exterior)
+                    elif exterior:
+                        break
+                    exterior = False
+        commands.addPoints(points)
+        if not commands.commands:
+            continue
+
+        values = feature.attributes()
+        if attributes != None:
+            values = [values[i] for i in attributes]
+        encoder.addFeature(feature.id(), MVT_TYPES[geometryType], commands.commands, dict(zip(names, [plainValue(value) for value in values])))
+    return mvt.encodeTile([encoder])
+
+@networkapi('/mvt/{layer}/{z}/{x}/{y}.mvt')
+def vectorTile(iface, request):
+    """
+    Return a Mapbox Vector Tile of the features of a vector layer.
+
+    Tiles follow the common XYZ scheme in web mercator projection, with the layer's ID as part of the URL: /mvt/{layer}/{z}/{x}/{y}.mvt
+
+    Features are clipped to the tile (plus a small margin), simplified and quantized to the tile's resolution. Encoded tiles are cached until the layer is modified.
+
+    HTTP query arguments:
+        fields (optional): comma-separated names of the fields to include as feature properties. Defaults to all fields.
+
+    Returns:
+        A vector tile containing one layer named like the QGIS layer.
+    """
+    layer = qgis_layer_by_id(request.args['layer'])
+    z = int(request.args['z'])
+    x = int(request.args['x'])
+    y = int(request.args['y'])
+    if not (0 <= z <= 30 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return NetworkAPIResult('No such tile', 'text/plain', 404)
+
+    attributes = fieldIndices(layer, request.args['fields']) if 'fields' in request.args else None
+    key = (layer.id(), layerVersion(layer), tuple(attributes) if attributes != None else None, z, x, y)
+    tile = vectorTiles.get(key)
+    if tile == None:
+        tile = encodeVectorTile(layer, attributes, z, x, y)
+        vectorTiles.put(key, tile)
+    return NetworkAPIResult(tile, 'application/vnd.mapbox-vector-tile')
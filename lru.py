@@ -0,0 +1,143 @@
+# least recently used caches in memory and on disk, independent of QGIS
+# (see cache.py for tracking the state of map layers)
+
+from collections import OrderedDict
+import time
+
+class LRUCache(object):
+    """Cache which evicts its least recently used entries once their total
+    size exceeds maxsize. Unless a sizeof function is given, every entry has
+    a size of 1. Entries which haven't been accessed for ttl seconds expire.
+    The optional evicted(key, value) callback is called for every entry that
+    is removed from the cache because of its size or age."""
+
+    def __init__(self, maxsize, ttl=None, sizeof=None, evicted=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda _: 1)
+        self.evicted = evicted
+        self.size = 0
+        # key -> (value, size, time of last access), least recently used first
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        self.expire()
+        return len(self.entries)
+
+    def __contains__(self, key):
+        self.expire()
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """Return the entry for the given key (marking it as recently used)"""
+        self.expire()
+        entry = self.entries.pop(key, None)
+        if entry == None:
+            return default
+        self.entries[key] = (entry[0], entry[1], time.time())
+        return entry[0]
+
+    def put(self, key, value):
+        """Add or replace an entry, evicting others if necessary"""
+        self.pop(key)
+        size = self.sizeof(value)
+        self.entries[key] = (value, size, time.time())
+        self.size = self.size + size
+        self.expire()
+        while self.size > self.maxsize and self.entries:
+            self.evict(next(iter(self.entries)))
+
+    def pop(self, key, default=None):
+        """Remove an entry from the cache and return it"""
+        entry = self.entries.pop(key, None)
+        if entry == None:
+            return default
+        self.size = self.size - entry[1]
+        return entry[0]
+
+    def discard(self, predicate):
+        """Remove all entries whose key satisfies the given predicate"""
+        for key in [key for key in self.entries if predicate(key)]:
+            self.pop(key)
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        self.entries.clear()
+        self.size = 0
+
+    def evict(self, key):
+        value = self.pop(key)
+        if self.evicted != None:
+            self.evicted(key, value)
+
+    def expire(self):
+        """Evict all entries which haven't been accessed within the ttl"""
+        if self.ttl == None:
+            return
+        # entries are ordered by their time of last access
+        deadline = time.time() - self.ttl
+        while self.entries:
+            key, entry = next(self.entries.iteritems())
+            if entry[2] > deadline:
+                break
+            self.evict(key)
+
+import os
+
+class DiskCache(object):
+    """Cache of byte strings stored as files below a directory, keyed by
+    their relative path. The least recently used files are removed once
+    their total size exceeds maxsize (in bytes). Files left over from
+    previous sessions are picked up, oldest first."""
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        # relative path -> file size
+        self.files = LRUCache(maxsize, sizeof=lambda size: size, evicted=lambda key, _: self.remove(key))
+        existing = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    existing.append((os.path.getmtime(path), os.path.relpath(path, directory), os.path.getsize(path)))
+                except OSError:
+                    pass
+        for _, key, size in sorted(existing):
+            self.files.put(key, size)
+
+    def get(self, key, default=None):
+        if self.files.get(key) == None:
+            return default
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                return f.read()
+        except IOError:
+            self.files.pop(key)
+            return default
+
+    def put(self, key, data):
+        path = os.path.join(self.directory, key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # write to a temporary file first so that no partially written
+            # files are ever read
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError):
+            # caching is optional
+            return
+        self.files.put(key, len(data))
+
+    def discard(self, predicate):
+        """Remove all files whose key satisfies the given predicate"""
+        for key in [key for key in self.files.entries if predicate(key)]:
+            self.files.pop(key)
+            self.remove(key)
+
+    def remove(self, key):
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
@@ -0,0 +1,161 @@
+# encoder for Mapbox Vector Tiles (version 2.1 of the specification), which
+# are protocol buffer messages. the few message types involved are simple
+# enough to be encoded directly, see
+# https://github.com/mapbox/vector-tile-spec/blob/master/2.1/vector_tile.proto
+
+import struct
+
+# geometry types
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+
+# coordinates within a tile range from 0 to EXTENT
+EXTENT = 4096
+
+def varint(n):
+    """Encode a non-negative integer as a protobuf varint"""
+    out = []
+    while n > 0x7f:
+        out.append(chr(n & 0x7f | 0x80))
+        n = n >> 7
+    out.append(chr(n))
+    return ''.join(out)
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def field(number, wiretype):
+    return varint(number << 3 | wiretype)
+
+def message(number, data):
+    """Encode a length-delimited field (string, bytes or sub-message)"""
+    return field(number, 2) + varint(len(data)) + data
+
+def packed(number, values):
+    return message(number, ''.join(varint(value) for value in values))
+
+def command(id, count):
+    return id & 0x7 | count << 3
+
+class GeometryEncoder(object):
+    """Builds the command sequence for the geometry of one feature from
+    integer tile coordinates. The cursor position carries over between the
+    parts of a multi-part geometry."""
+
+    def __init__(self):
+        self.commands = []
+        self.x = 0
+        self.y = 0
+
+    def moveTo(self, points):
+        self.commands.append(command(1, len(points)))
+        self.deltas(points)
+
+    def lineTo(self, points):
+        self.commands.append(command(2, len(points)))
+        self.deltas(points)
+
+    def closePath(self):
+        self.commands.append(command(7, 1))
+
+    def deltas(self, points):
+        for x, y in points:
+            self.commands.append(zigzag(x - self.x))
+            self.commands.append(zigzag(y - self.y))
+            self.x = x
+            self.y = y
+
+    def addPoints(self, points):
+        if points:
+            self.moveTo(points)
+
+    def addLine(self, line):
+        """Add a line of at least two points"""
+        self.moveTo(line[:1])
+        self.lineTo(line[1:])
+
+    def addRing(self, ring, exterior):
+        """Add a ring of at least three points (without repeating the first
+        point at the end), fixing its winding order: exterior rings have to
+        have a positive, interior rings a negative area in tile coordinates
+        (in which y points down)"""
+        if (area(ring) > 0) != exterior:
+            ring = ring[::-1]
+        self.moveTo(ring[:1])
+        self.lineTo(ring[1:])
+        self.closePath()
+
+def area(ring):
+    """Twice the signed area of a ring (surveyor's formula)"""
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+class LayerEncoder(object):
+    """Collects the features of one layer of a vector tile"""
+
+    def __init__(self, name, extent=EXTENT):
+        self.name = name
+        self.extent = extent
+        self.features = []
+        # keys and values are stored once per layer and referred to by index
+        self.keys = {}
+        self.values = {}
+
+    def index(self, table, key):
+        if key not in table:
+            table[key] = len(table)
+        return table[key]
+
+    def addFeature(self, id, type, geometry, attributes):
+        """Add a feature given its id (or None), geometry type, geometry
+        commands (see GeometryEncoder) and a dictionary of attributes"""
+        tags = []
+        for key, value in attributes.iteritems():
+            if value == None:
+                continue
+            tags.append(self.index(self.keys, key))
+            # distinguish e.g. 1, 1.0 and True
+            tags.append(self.index(self.values, (type_(value), value)))
+        feature = []
+        if id != None and id >= 0:
+            feature.append(field(1, 0) + varint(id))
+        if tags:
+            feature.append(packed(2, tags))
+        feature.append(field(3, 0) + varint(type))
+        feature.append(packed(4, geometry))
+        self.features.append(''.join(feature))
+
+    def encode(self):
+        out = [field(15, 0) + varint(2), message(1, self.name.encode('utf-8'))]
+        for feature in self.features:
+            out.append(message(2, feature))
+        for key in sorted(self.keys, key=self.keys.get):
+            out.append(message(3, key.encode('utf-8')))
+        for value in sorted(self.values, key=self.values.get):
+            out.append(message(4, encodeValue(value[1])))
+        out.append(field(5, 0) + varint(self.extent))
+        return ''.join(out)
+
+def type_(value):
+    if isinstance(value, bool):
+        return bool
+    if isinstance(value, (int, long)):
+        return int
+    return type(value)
+
+def encodeValue(value):
+    if isinstance(value, bool):
+        return field(7, 0) + varint(int(value))
+    if isinstance(value, (int, long)):
+        if value >= 0:
+            return field(5, 0) + varint(value)
+        return field(6, 0) + varint(zigzag(value))
+    if isinstance(value, float):
+        return field(3, 1) + struct.pack('<d', value)
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return message(1, value.encode('utf-8'))
+
+def encodeTile(layers):
+    """Encode a vector tile from a list of LayerEncoders"""
+    return ''.join(message(3, layer.encode()) for layer in layers if layer.features)
@@ -1,8 +1,11 @@
 from functools import wraps
+import re
 
 class Registry:
     __singleton = None
     paths = {}
+    # paths containing {name} placeholders as (regular expression, handler)
+    patterns = []
 
     @staticmethod
     def instance():
@@ -17,10 +20,23 @@ class Registry:
     @staticmethod
     def add_path(path, handler_function):
         Registry.instance().paths[path.rstrip('/')] = handler_function
+        if '{' in path:
+            regex = re.sub(r'\\\{(\w+)\\\}', r'(?P<\1>[^/]+)', re.escape(path.rstrip('/')))
+            Registry.instance().patterns.append((re.compile(regex + '$'), handler_function))
 
     @staticmethod
     def get(path):
-        return Registry.instance().paths.get(path)
+        handler_function = Registry.instance().paths.get(path)
+        if handler_function == None:
+            for regex, function in Registry.instance().patterns:
+                match = regex.match(path)
+                if match:
+                    # the values of placeholders are passed as arguments
+                    def handler_function(iface, request, function=function, values=match.groupdict()):
+                        request.args.update(values)
+                        return function(iface, request)
+                    break
+        return handler_function
 
 # @networkapi decorator for functions processing iface and request
 def networkapi(path):
@@ -35,13 +51,90 @@ class NetworkAPIResult:
     # TODO what status to send in case of invalid/malformed request arguments?
     INVALID_ARGUMENTS = 418
 
-    def __init__(self, body = None, content_type = None, status = 200):
+    # if a content_type is given, the body can also be an iterator (such as a
+    # generator function) producing the response piece by piece as strings,
+    # which is then streamed to the client while it is being generated.
+    # additional response headers can be passed as a dictionary
+    def __init__(self, body = None, content_type = None, status = 200, headers = None):
         self.body = body
         self.content_type = content_type
         self.status = status
+        self.headers = headers or {}
+
+from PyQt4.QtCore import QObject, pyqtSignal
+
+# returned by a ResponseStream when none of the response body is available yet
+PENDING = object()
+
+class ResponseStream(QObject):
+    """Response body which is produced asynchronously, e.g. by slots connected
+    to the signals of background jobs, rather than by a generator: data
+    passed to write() is sent to the client as it becomes available, until
+    finish() is called (or fail(), which aborts the response). Handlers
+    return it as the body of a NetworkAPIResult (with a content_type), and
+    can connect to the 'closed' signal to stop producing data when the client
+    goes away.
+
+    Supports write() and tell() like a file, so it can also be passed to e.g.
+    a ZipFile."""
+
+    # emitted when more data (or the end of the body) is available
+    ready = pyqtSignal()
+    # emitted when the body is no longer needed
+    closed = pyqtSignal()
+
+    def __init__(self):
+        QObject.__init__(self)
+        self.chunks = []
+        self.position = 0
+        self.finished = False
+        self.error = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return the data written since the last call, PENDING if there is
+        none yet"""
+        if self.chunks:
+            data = ''.join(self.chunks)
+            self.chunks = []
+            return data
+        if self.error != None:
+            raise self.error
+        if self.finished:
+            raise StopIteration
+        return PENDING
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position = self.position + len(data)
+        self.ready.emit()
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        self.finished = True
+        self.ready.emit()
+
+    def fail(self, error):
+        self.error = error
+        self.finished = True
+        self.ready.emit()
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.closed.emit()
+
 # response body can be of any type and will be automatically converted by the
-# server using json.dump() based on the following encoder:
+# server using the following encoder's iterencode():
 from json import JSONEncoder
+from types import GeneratorType
 
 from PyQt4.QtCore import QDate, QDateTime, QPyNullVariant, QSize, QTime, Qt
 
@@ -53,44 +146,169 @@ from qgis.gui import QgsMapCanvas
 # add conversion for LayerType, https://qgis.org/api/classQgsUnitTypes.html
 
 class QGISJSONEncoder(JSONEncoder):
-    def default(self, o):
 
-        ### Qt types (in alphabetical order)
-        if isinstance(o, QDate) or isinstance(o, QDateTime) or isinstance(o, QTime):
-            # there is not actual date/time type in JSON, so convert to string
-            return o.toString(Qt.ISODate)
-        elif isinstance(o, QPyNullVariant):
-            # Qt's very own 'null'
-            return None
-        elif isinstance(o, QSize):
-            return [o.width(), o.height()]
-
-
-        ### QGIS types (in alphabetical order)
-        elif isinstance(o, QgsCoordinateReferenceSystem):
-            return {'description': o.description(), 'srsid': o.srsid(), 'proj4': o.toProj4(), 'postgisSrid': o.postgisSrid()}
-        elif isinstance(o, QgsFeature):
-            return {'id': o.id(), 'attributes': dict(zip([field.name() for field in o.fields().toList()], o.attributes())) }
-        elif isinstance(o, QgsFeatureIterator):
-            return list(o)
-        elif isinstance(o, QgsFields): # 'isNumeric': f.isNumeric(),  from 2.18
-            return [{'name': f.name(), 'comment': f.comment(), 'length': f.length() } for f in o.toList()]
-        #elif isinstance(o, QgsGeometry):
-          # use QgsVectorFileWriter instead (see below)
-        elif isinstance(o, QgsMapSettings):
-            return { 'destinationCrs': o.destinationCrs(), 'extent': o.extent(), 'fullExtent': o.fullExtent(), 'layers': o.layers(), 'mapUnits': o.mapUnits(), 'mapUnitsPerPixel': o.mapUnitsPerPixel(), 'outputSize': o.outputSize(), 'rotation': o.rotation(), 'scale': o.scale(), 'visibleExtent': o.visibleExtent()}
-        elif isinstance(o, QgsMapLayer):
-            return {'id': o.id(), 'valid': o.isValid(), 'name': o.name(), 'type': o.type(), 'publicSource': o.publicSource(), 'crs': o.crs(), 'extent': o.extent(), 'isEditable': o.isEditable()}
-        elif isinstance(o, QgsPoint):
-            return [o.x(), o.y()]
-        elif isinstance(o, QgsRectangle):
-            # same order as e.g. sf's 'bbox' class
-            return [o.xMinimum(), o.yMinimum(), o.xMaximum(), o.yMaximum()]
+    # sequences which are encoded element by element when passed to
+    # iterencode() directly, rather than being turned into a list first
+    LAZY_SEQUENCES = (QgsFeatureIterator, GeneratorType)
+
+    def iterencode(self, o, _one_shot=False):
+        """Encode the given object, returning an iterator over the pieces of
+        the resulting JSON string. Lazy sequences such as QgsFeatureIterators
+        are encoded one element at a time, so that memory use is independent
+        of the number of their elements. Other objects are encoded in one go
+        (which is considerably faster in compact mode, i.e. without indent)"""
+        if isinstance(o, QGISJSONEncoder.LAZY_SEQUENCES):
+            return self.iterencode_lazy(o)
+        if _one_shot:
+            return JSONEncoder.iterencode(self, o, _one_shot)
+        return iter([self.encode(o)])
+
+    def iterencode_lazy(self, o):
+        separator = self.item_separator
+        if self.indent != None:
+            # the elements themselves are not indented, but at least put them
+            # on separate lines
+            separator = separator.rstrip() + '\n'
+        yield '['
+        first = True
+        for element in lazyElements(o):
+            if not first:
+                yield separator
+            first = False
+            yield self.encode(element)
+        yield ']'
+
+    # functions converting objects of a specific type into something that can
+    # be encoded as JSON, see register() and @jsonencoder below
+    encoders = {}
+    # encoder functions (or None) for all types encountered so far, including
+    # types whose encoder was found via one of their base classes
+    resolved = {}
+
+    @staticmethod
+    def register(type_, function):
+        QGISJSONEncoder.encoders[type_] = function
+        QGISJSONEncoder.resolved.clear()
+
+    @staticmethod
+    def lookup(type_):
+        """Find the encoder function for the given type: an exact match is
+        looked up first, then the type's base classes in method resolution
+        order. Returns None if no function was registered for the type."""
+        try:
+            return QGISJSONEncoder.resolved[type_]
+        except KeyError:
+            function = None
+            for base in type_.__mro__:
+                if base in QGISJSONEncoder.encoders:
+                    function = QGISJSONEncoder.encoders[base]
+                    break
+            QGISJSONEncoder.resolved[type_] = function
+            return function
 
+    def default(self, o):
+        function = QGISJSONEncoder.lookup(type(o))
+        if function != None:
+            return function(o)
         # default encoding -- prints a conversion error in the middle of the
         # HTTP response if the structure is not a primitive
         return JSONEncoder.default(self, o)
 
+# @jsonencoder decorator for functions converting objects of the given types
+def jsonencoder(*types):
+    def register(encoder_function):
+        for type_ in types:
+            QGISJSONEncoder.register(type_, encoder_function)
+        return encoder_function
+    return register
+
+### Qt types (in alphabetical order)
+@jsonencoder(QDate, QDateTime, QTime)
+def encodeDateTime(o):
+    # there is not actual date/time type in JSON, so convert to string
+    return o.toString(Qt.ISODate)
+
+@jsonencoder(QPyNullVariant)
+def encodeNull(o):
+    # Qt's very own 'null'
+    return None
+
+@jsonencoder(QSize)
+def encodeSize(o):
+    return [o.width(), o.height()]
+
+### QGIS types (in alphabetical order)
+@jsonencoder(QgsCoordinateReferenceSystem)
+def encodeCoordinateReferenceSystem(o):
+    return {'description': o.description(), 'srsid': o.srsid(), 'proj4': o.toProj4(), 'postgisSrid': o.postgisSrid()}
+
+@jsonencoder(QgsFeature)
+def encodeFeature(o):
+    return featureToDict(o, fieldNames(o))
+
+@jsonencoder(QgsFeatureIterator)
+def encodeFeatureIterator(o):
+    return list(o)
+
+@jsonencoder(QgsFields)
+def encodeFields(o):
+    # 'isNumeric': f.isNumeric(),  from 2.18
+    return [{'name': f.name(), 'comment': f.comment(), 'length': f.length() } for f in o.toList()]
+
+# QgsGeometry: see toGeoJSON() below
+
+@jsonencoder(QgsMapSettings)
+def encodeMapSettings(o):
+    return { 'destinationCrs': o.destinationCrs(), 'extent': o.extent(), 'fullExtent': o.fullExtent(), 'layers': o.layers(), 'mapUnits': o.mapUnits(), 'mapUnitsPerPixel': o.mapUnitsPerPixel(), 'outputSize': o.outputSize(), 'rotation': o.rotation(), 'scale': o.scale(), 'visibleExtent': o.visibleExtent()}
+
+@jsonencoder(QgsMapLayer)
+def encodeMapLayer(o):
+    return {'id': o.id(), 'valid': o.isValid(), 'name': o.name(), 'type': o.type(), 'publicSource': o.publicSource(), 'crs': o.crs(), 'extent': o.extent(), 'isEditable': o.isEditable()}
+
+@jsonencoder(QgsPoint)
+def encodePoint(o):
+    return [o.x(), o.y()]
+
+@jsonencoder(QgsRectangle)
+def encodeRectangle(o):
+    # same order as e.g. sf's 'bbox' class
+    return [o.xMinimum(), o.yMinimum(), o.xMaximum(), o.yMaximum()]
+
+def plainValue(o):
+    """Convert an attribute value to a basic (hashable) python type using the
+    registered JSON conversions, e.g. QPyNullVariant to None"""
+    function = QGISJSONEncoder.lookup(type(o))
+    return o if function == None else function(o)
+
+def fieldNames(feature):
+    return [field.name() for field in feature.fields().toList()]
+
+def featureToDict(feature, names):
+    """Convert a feature to a dictionary of its id and attributes, given the
+    names of its fields"""
+    return {'id': feature.id(), 'attributes': dict(zip(names, feature.attributes()))}
+
+def featuresToDicts(layer, features, attributes):
+    """Convert features to dictionaries of their id and the attributes with
+    the given field indices"""
+    names = [layer.fields().at(i).name() for i in attributes]
+    for feature in features:
+        values = feature.attributes()
+        yield {'id': feature.id(), 'attributes': dict(zip(names, [values[i] for i in attributes]))}
+
+def lazyElements(o):
+    """Iterate over the elements of a lazy sequence, converting features to
+    dictionaries along the way"""
+    # all features from one iterator share the same fields, so their names
+    # only have to be looked up once
+    names = None
+    for element in o:
+        if isinstance(element, QgsFeature):
+            if names == None:
+                names = fieldNames(element)
+            element = featureToDict(element, names)
+        yield element
+
 def parseCRS(spec):
     try:
         spec = float(spec)
@@ -105,39 +323,41 @@ def parseCRS(spec):
             raise ValueError("Can't process CRS specification: " + spec)
     return crs
 
-import os
-from tempfile import mkstemp
-from qgis.core import QgsVectorFileWriter
+from collections import OrderedDict
 
-def toGeoJSON(layer, features):
+def toGeoJSON(layer, features, precision=17, attributes=None):
     """
-    Convert a list of QgsFeatures including their geometries to GeoJSON.
+    Convert a list of QgsFeatures including their geometries to GeoJSON. If
+    a list of field indices is given, only those attributes are included.
+
+    Returns a generator producing the GeoJSON FeatureCollection one feature at
+    a time, which can be passed straight to a NetworkAPIResult.
     """
-    tmpfile, tmpfilename = mkstemp('.geojson')
-    os.close(tmpfile)
-    # supporting arbitrary output formats would be great but unfortunately
-    # the QgsVectorFileWriter adds an extension to the supplied filename if
-    # it doesn't have the correct one already. so in order to robustly
-    # support all formats we'd have to create the temporary filename
-    # according to QgsVectorFileWriter.supportedFiltersAndFormats()
-    # (there's still more added complexity from the fact that some formats
-    # are spread across more than one file...)
-    writer = QgsVectorFileWriter(tmpfilename, None, layer.fields(), layer.wkbType(), layer.crs(), 'GeoJSON')
+    encoder = QGISJSONEncoder()
+    yield '{\n"type": "FeatureCollection",\n'
+    # same coordinate reference system identifiers as written by OGR
+    authid = layer.crs().authid()
+    if authid == 'EPSG:4326':
+        yield '"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" } },\n'
+    elif authid.startswith('EPSG:'):
+        yield '"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:EPSG::' + authid[5:] + '" } },\n'
+    yield '"features": [\n'
 
+    first = True
+    names = [field.name() for field in layer.fields().toList()]
+    if attributes != None:
+        names = [names[i] for i in attributes]
     for f in features:
-        # TODO check returned boolean?
-        writer.addFeature(f)
-
-    if writer.hasError():
-        msg = writer.errorMessage()
-        del writer
-        os.remove(tmpfilename)
-        raise IOError(msg)
-
-    # flush to file
-    del writer
-
-    with open(tmpfilename, 'r') as content_file:
-        content = content_file.read()
-    os.remove(tmpfilename)
-    return content
+        if f.geometry() == None or f.geometry().isEmpty():
+            geometry = 'null'
+        else:
+            geometry = f.geometry().exportToGeoJSON(precision)
+        values = f.attributes()
+        if attributes != None:
+            values = [values[i] for i in attributes]
+        # keep properties in the order of the layer's fields
+        properties = encoder.encode(OrderedDict(zip(names, values)))
+        yield ('' if first else ',\n') + '{ "type": "Feature", "id": ' + str(f.id()) + ', "properties": ' + properties + ', "geometry": ' + geometry + ' }'
+        first = False
+
+    yield '\n]\n}\n'
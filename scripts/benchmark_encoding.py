@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for the conversion of QGIS objects into response bodies.
+
+Needs to be run with a Python interpreter that can import the QGIS 2 python
+bindings (see scripts/run-env-linux.sh), e.g.:
+
+    python scripts/benchmark_encoding.py [benchmark ...]
+
+Without arguments, all benchmarks are run.
+"""
+
+import imp
+import os
+import sys
+import time
+from json import JSONEncoder
+
+from PyQt4.QtCore import QDate, QDateTime, QPyNullVariant, QSize, QTime, QVariant, Qt
+from qgis.core import QgsApplication, QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsPoint, QgsRectangle, QgsVectorLayer
+
+# plugin modules use relative imports, so the repository root is imported as
+# a package (under a fixed name, whatever the checkout directory is called)
+imp.load_module('networkapi', None, os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ('', '', imp.PKG_DIRECTORY))
+
+def timed(function, *args):
+    """Return the fastest of three runs of the given function (in seconds)"""
+    timings = []
+    for _ in range(3):
+        start = time.time()
+        function(*args)
+        timings.append(time.time() - start)
+    return min(timings)
+
+def memory_layer(nfields, nfeatures):
+    """Create a geometry-less memory layer with alternating integer and string
+    fields"""
+    layer = QgsVectorLayer('None', 'benchmark', 'memory')
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField('field' + str(i), QVariant.Int if i % 2 else QVariant.String) for i in range(nfields)])
+    layer.updateFields()
+    features = []
+    for i in range(nfeatures):
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes([i if j % 2 else 'value ' + str(i) for j in range(nfields)])
+        features.append(feature)
+    provider.addFeatures(features)
+    return layer
+
+def polygon_layer(nfeatures):
+    """Create a memory layer of 32-gons with a string and an integer field"""
+    from qgis.core import QgsGeometry
+    layer = QgsVectorLayer('Polygon?crs=epsg:4326&field=name:string&field=value:integer', 'benchmark', 'memory')
+    features = []
+    for i in range(nfeatures):
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes(['polygon ' + str(i), i])
+        feature.setGeometry(QgsGeometry.fromPoint(QgsPoint(i % 360 - 180, i % 180 - 90)).buffer(0.1, 8))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+def benchmark_features():
+    """Encoding all features of narrow and wide layers to JSON"""
+    from networkapi.registry import QGISJSONEncoder
+
+    class LegacyEncoder(QGISJSONEncoder):
+        # previous approach: look up field names and convert attributes
+        # through the encoder's default() for every single feature
+        def default(self, o):
+            if isinstance(o, QgsFeature):
+                return {'id': o.id(), 'attributes': dict(zip([field.name() for field in o.fields().toList()], o.attributes()))}
+            return QGISJSONEncoder.default(self, o)
+
+    def legacy(layer):
+        JSONEncoder.encode(LegacyEncoder(separators=(',', ':')), list(layer.getFeatures()))
+
+    def current(layer):
+        ''.join(QGISJSONEncoder(separators=(',', ':')).iterencode(layer.getFeatures()))
+
+    print '%-8s %8s %10s %12s %12s' % ('layer', 'fields', 'features', 'legacy (s)', 'current (s)')
+    for name, nfields, nfeatures in [('narrow', 5, 100000), ('wide', 200, 5000)]:
+        layer = memory_layer(nfields, nfeatures)
+        print '%-8s %8d %10d %12.3f %12.3f' % (name, nfields, nfeatures, timed(legacy, layer), timed(current, layer))
+
+def benchmark_values():
+    """Encoding 1M mixed Qt/QGIS values to JSON"""
+    from networkapi.registry import QGISJSONEncoder
+
+    class LegacyEncoder(JSONEncoder):
+        # previous approach: linear chain of isinstance() checks (abridged to
+        # the types used below, plus the checks preceding them)
+        def default(self, o):
+            if isinstance(o, QDate) or isinstance(o, QDateTime) or isinstance(o, QTime):
+                return o.toString(Qt.ISODate)
+            elif isinstance(o, QPyNullVariant):
+                return None
+            elif isinstance(o, QSize):
+                return [o.width(), o.height()]
+            elif isinstance(o, QgsCoordinateReferenceSystem):
+                return {'description': o.description(), 'srsid': o.srsid(), 'proj4': o.toProj4(), 'postgisSrid': o.postgisSrid()}
+            elif isinstance(o, QgsFeature):
+                return {'id': o.id(), 'attributes': dict(zip([field.name() for field in o.fields().toList()], o.attributes()))}
+            elif isinstance(o, QgsPoint):
+                return [o.x(), o.y()]
+            elif isinstance(o, QgsRectangle):
+                return [o.xMinimum(), o.yMinimum(), o.xMaximum(), o.yMaximum()]
+            return JSONEncoder.default(self, o)
+
+    values = [QgsPoint(1, 2), QDateTime.currentDateTime(), QgsRectangle(0, 0, 1, 1), QSize(10, 20), QPyNullVariant(int), 42] * (1000000 / 6)
+    print '%12s %12s' % ('legacy (s)', 'current (s)')
+    print '%12.3f %12.3f' % (timed(LegacyEncoder(separators=(',', ':')).encode, values), timed(QGISJSONEncoder(separators=(',', ':')).encode, values))
+
+def benchmark_geojson():
+    """Converting all features of a polygon layer to GeoJSON"""
+    from networkapi.registry import toGeoJSON
+    from tempfile import mkstemp
+    from qgis.core import QgsVectorFileWriter
+
+    def legacy(layer):
+        # previous approach: write through OGR into a temporary file, then
+        # read it back in
+        tmpfile, tmpfilename = mkstemp('.geojson')
+        os.close(tmpfile)
+        writer = QgsVectorFileWriter(tmpfilename, None, layer.fields(), layer.wkbType(), layer.crs(), 'GeoJSON')
+        for f in layer.getFeatures():
+            writer.addFeature(f)
+        del writer
+        with open(tmpfilename, 'r') as content_file:
+            content = content_file.read()
+        os.remove(tmpfilename)
+        return content
+
+    def current(layer):
+        return ''.join(toGeoJSON(layer, layer.getFeatures()))
+
+    layer = polygon_layer(50000)
+    print '%10s %12s %12s' % ('features', 'legacy (s)', 'current (s)')
+    print '%10d %12.3f %12.3f' % (layer.featureCount(), timed(legacy, layer), timed(current, layer))
+
+def benchmark_geometry():
+    """Size and encoding time of all features of a 500k polygon layer as
+    GeoJSON, WKB records and FlatGeobuf"""
+    from networkapi.registry import toGeoJSON
+    from networkapi.formats import FEATURE_FORMATS, toFlatGeobuf, toWKB
+
+    encodings = [
+        ('geojson', lambda layer: toGeoJSON(layer, layer.getFeatures())),
+        ('wkb', lambda layer: toWKB(layer, layer.getFeatures()))
+    ]
+    if 'fgb' in FEATURE_FORMATS:
+        encodings.append(('fgb', lambda layer: toFlatGeobuf(layer, layer.getFeatures())))
+
+    layer = polygon_layer(500000)
+    print '%-8s %12s %10s' % ('format', 'size (MB)', 'time (s)')
+    for name, encode in encodings:
+        size = len(''.join(encode(layer))) / 1024.0 / 1024
+        elapsed = timed(lambda: ''.join(encode(layer)))
+        print '%-8s %12.2f %10.3f' % (name, size, elapsed)
+
+def benchmark_binary():
+    """Size and encoding time of all features of a narrow layer as JSON,
+    MessagePack and CBOR"""
+    from networkapi.registry import QGISJSONEncoder
+    from networkapi.formats import BINARY_FORMATS
+
+    encodings = [('json', lambda o: QGISJSONEncoder(separators=(',', ':')).iterencode(o))]
+    for content_type, name in [('application/msgpack', 'msgpack'), ('application/cbor', 'cbor')]:
+        if content_type in BINARY_FORMATS:
+            encodings.append((name, BINARY_FORMATS[content_type]))
+
+    layer = memory_layer(5, 100000)
+    print '%-8s %12s %10s' % ('format', 'size (MB)', 'time (s)')
+    for name, encode in encodings:
+        size = len(''.join(encode(layer.getFeatures()))) / 1024.0 / 1024
+        elapsed = timed(lambda: ''.join(encode(layer.getFeatures())))
+        print '%-8s %12.2f %10.3f' % (name, size, elapsed)
+
+BENCHMARKS = {
+    'binary': benchmark_binary,
+    'features': benchmark_features,
+    'geojson': benchmark_geojson,
+    'geometry': benchmark_geometry,
+    'values': benchmark_values,
+}
+
+if __name__ == '__main__':
+    app = QgsApplication([], False)
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    QgsApplication.initQgis()
+
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print '\n' + name + ': ' + BENCHMARKS[name].__doc__
+        BENCHMARKS[name]()
+
+    QgsApplication.exitQgis()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Measure request body upload throughput of the Network API.
+
+By default, POSTs bodies of increasing size to a running QGIS instance with
+the Network API enabled and reports the throughput for each body size:
+
+    python scripts/benchmark_upload.py [--port 8090] [--sizes 1,10,100]
+
+With --offline, compares the previous strategy of accumulating the request
+body by repeated string concatenation against collecting the chunks in a list
+and joining them once, without requiring a running QGIS:
+
+    python scripts/benchmark_upload.py --offline
+"""
+
+import httplib
+import optparse
+import time
+
+# typical amount of data returned by a single readAll() on a local socket
+CHUNK_SIZE = 64 * 1024
+
+def upload(port, size):
+    """POST a body of the given size (in bytes) and return the elapsed time"""
+    body = 'x' * size
+    connection = httplib.HTTPConnection('localhost', port)
+    start = time.time()
+    # this path doesn't process the body, so the time taken is dominated by
+    # receiving the data
+    connection.request('POST', '/qgis/mapLayers/count', body)
+    connection.getresponse().read()
+    elapsed = time.time() - start
+    connection.close()
+    return elapsed
+
+def accumulate_concat(chunks):
+    # like the previous set_payload(get_payload() + data), the payload is
+    # referenced from elsewhere so it can't be resized in place
+    message = {'payload': ''}
+    for chunk in chunks:
+        message['payload'] = message['payload'] + chunk
+    return message['payload']
+
+def accumulate_list(chunks):
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+    return ''.join(body)
+
+def offline(size):
+    chunks = ['x' * CHUNK_SIZE] * (size / CHUNK_SIZE)
+    timings = []
+    for accumulate in (accumulate_concat, accumulate_list):
+        start = time.time()
+        accumulate(chunks)
+        timings.append(time.time() - start)
+    return timings
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8090)
+    parser.add_option('--sizes', default='1,10,100', help='comma-separated body sizes in MB')
+    parser.add_option('--offline', action='store_true')
+    options, _ = parser.parse_args()
+
+    sizes = [int(float(s) * 1024 * 1024) for s in options.sizes.split(',')]
+    if options.offline:
+        print '%10s %16s %16s' % ('size (MB)', 'concat (MB/s)', 'list (MB/s)')
+        for size in sizes:
+            mb = size / 1024.0 / 1024
+            concat, joined = offline(size)
+            print '%10.1f %16.1f %16.1f' % (mb, mb / concat, mb / joined)
+    else:
+        print '%10s %10s %12s' % ('size (MB)', 'time (s)', 'MB/s')
+        for size in sizes:
+            mb = size / 1024.0 / 1024
+            elapsed = upload(options.port, size)
+            print '%10.1f %10.3f %12.1f' % (mb, elapsed, mb / elapsed)
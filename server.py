@@ -1,21 +1,110 @@
-from PyQt4.QtCore import pyqtSignal, QTimer
-from PyQt4.QtNetwork import QHostAddress, QTcpServer
+from PyQt4.QtCore import pyqtSignal, QObject, QTimer
+from PyQt4.QtNetwork import QAbstractSocket, QHostAddress, QTcpServer
 from network_api_dialog import NetworkAPIDialog
 from qgis.core import QgsMessageLog
 from qgis.gui import QgsMessageBar
 
 # request+response processing
-from json import dump, loads
+from json import loads
 
 # response processing
 from PyQt4.QtXml import QDomDocument
-from .registry import QGISJSONEncoder, Registry
+from .registry import PENDING, QGISJSONEncoder, Registry, ResponseStream
+from .formats import BINARY_FORMATS
+
+def preferred(header, candidates):
+    """Pick the candidate with the highest preference from the value of an
+    Accept or Accept-Encoding request header, or None if none is acceptable.
+    Candidates which are equally fine are preferred in the order given."""
+    choice = None
+    preference = 0
+    for item in header.split(','):
+        parameters = item.split(';')
+        name = parameters[0].strip().lower()
+        q = 1.0
+        for parameter in parameters[1:]:
+            key, _, value = parameter.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if name in candidates and q > 0 and (q > preference or (q == preference and candidates.index(name) < candidates.index(choice))):
+            choice = name
+            preference = q
+    return choice
+
+# content types which an automatically converted response body can be
+# encoded as, JSON being the default
+RESPONSE_FORMATS = ['application/json'] + BINARY_FORMATS.keys()
+
+# response streaming
+from collections import Iterator
+
+# streamed response bodies are sent in chunks of (at least) this size...
+STREAM_CHUNK_SIZE = 64 * 1024
+# ...and no more chunks are generated while this much is still waiting to be
+# written to the network
+STREAM_BUFFER_SIZE = 4 * STREAM_CHUNK_SIZE
+
+def buffered(chunks, size=STREAM_CHUNK_SIZE):
+    """Concatenate the (possibly very small) pieces of a response body
+    produced by an iterator into chunks of at least the given size. The last
+    chunk generated can be smaller, or empty."""
+    buf = []
+    length = 0
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        else:
+            chunk = str(chunk)
+        buf.append(chunk)
+        length = length + len(chunk)
+        if length >= size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    yield ''.join(buf)
+
+# response compression
+import zlib
+
+# content types which are not worth compressing any further
+INCOMPRESSIBLE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/zip', 'application/gzip', 'multipart/mixed')
+
+# zlib window size parameter selecting the container format for each of the
+# supported HTTP content-codings
+COMPRESSION_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+def acceptedEncoding(header):
+    """Pick the supported compression method with the highest preference
+    from the value of an Accept-Encoding request header, or None"""
+    # prefer gzip over deflate if both are equally fine
+    return preferred(header, ['gzip', 'deflate'])
+
+def compressed(first, stream, encoding, level):
+    """Compress a streamed response body (of which the first chunk has
+    already been retrieved)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    try:
+        yield compressor.compress(first)
+        for chunk in stream:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+    finally:
+        stream.close()
 
 # import actual API functions/paths
 from . import doc
 from . import functions
 from . import functions_processing
 from . import functions_style
+from . import functions_statistics
+from . import functions_render
+from . import functions_tiles
 
 class NetworkAPIServer(QTcpServer):
 
@@ -37,12 +126,15 @@ class NetworkAPIServer(QTcpServer):
     def __init__(self, iface):
         QTcpServer.__init__(self)
         self.iface = iface
-
-        # timer for interrupting open connections on inactivity
-        self.timer = QTimer()
-        self.timer.setInterval(3000) # 3 seconds, worth making configurable?
-        self.timer.setSingleShot(True)
-        self.timer.timeout.connect(self.timeout)
+        # all currently open connections
+        self.connections = []
+        # connections with a fully received request, waiting for their turn
+        # to be executed
+        self.queue = []
+        # whether a request is currently being executed
+        self.busy = False
+        self.nrequests = 0
+        self.newConnection.connect(self.acceptConnection)
 
     def log(self, message, level=QgsMessageLog.INFO):
         "Print a message to QGIS' Log Messages Panel"
@@ -62,9 +154,11 @@ class NetworkAPIServer(QTcpServer):
     def stopServer(self):
         if self.isListening():
             self.log('Stopping to listen on port ' + str(self.serverPort()))
-            # open/running requests are automatically wrapped up through their
-            # 'disconnect' signal triggering finishConnection()
             self.close()
+            # open/running requests are wrapped up through their 'disconnect'
+            # signal triggering NetworkAPIConnection.finish()
+            for connection in list(self.connections):
+                connection.socket.disconnectFromHost()
             self.emitStatusSignal(0)
 
     def startServer(self, port):
@@ -72,12 +166,8 @@ class NetworkAPIServer(QTcpServer):
             # already listening on that port, carry on
             return
         self.stopServer()
-        # process one connection/request at a time
-        self.connection = None
-        self.request = None
         self.nrequests = 0
 
-        self.newConnection.connect(self.acceptConnection)
         if self.listen(QHostAddress.Any, port):
             self.emitStatusSignal(1)
         else:
@@ -85,85 +175,308 @@ class NetworkAPIServer(QTcpServer):
             self.emitStatusSignal(0, 'Error: failed to open socket on port ' + str(port))
 
     def acceptConnection(self):
-        """Accept a new incoming connection request. If the server is still
-        busy processing an earlier request, the function returns immediately and the new incoming connection will be taken care of when the current
-        request is finished (see the call to hasPendingConnections() in
-        finishConnection() below)"""
-        if self.connection == None:
-            cxn = self.nextPendingConnection()
-            if not NetworkAPIDialog.settings.remote_connections() and cxn.peerAddress() != QHostAddress.LocalHost: # FIXME .LocalHostIPv6?
-                self.showMessage('Refusing remote connection from ' + cxn.peerAddress().toString(), QgsMessageBar.WARNING)
-                cxn.close()
+        """Accept new incoming connections. If the maximum number of open
+        connections has been reached, the function returns immediately and
+        the new incoming connections will be taken care of once earlier
+        connections are closed (see the call in connectionClosed() below)"""
+        while self.hasPendingConnections():
+            if len(self.connections) >= NetworkAPIDialog.settings.max_connections():
+                idle = [connection for connection in self.connections if connection.idle()]
+                if idle:
+                    # make room by closing a persistent connection waiting for
+                    # its next request, the new connection is accepted by
+                    # connectionClosed()
+                    self.log(str(len(self.connections)) + ' connections open, closing idle connection #' + str(idle[0].number))
+                    idle[0].socket.disconnectFromHost()
+                else:
+                    self.log(str(len(self.connections)) + ' connections open, putting incoming connection on hold...')
                 return
-            self.connection = cxn
+            socket = self.nextPendingConnection()
+            if not NetworkAPIDialog.settings.remote_connections() and socket.peerAddress() != QHostAddress.LocalHost: # FIXME .LocalHostIPv6?
+                self.showMessage('Refusing remote connection from ' + socket.peerAddress().toString(), QgsMessageBar.WARNING)
+                socket.close()
+                socket.deleteLater()
+                continue
             self.nrequests = self.nrequests + 1
-            self.log('Processing connection #' + str(self.nrequests) + ' (' + self.connection.peerAddress().toString() + ')')
-            self.connection.disconnected.connect(self.finishConnection)
-            self.connection.readyRead.connect(self.readFromConnection)
-            self.readFromConnection()
-        else:
-            self.log('Still busy with #' + str(self.nrequests) + ', putting incoming connection on hold...')
+            self.connections.append(NetworkAPIConnection(self, socket, self.nrequests))
+
+    def connectionClosed(self, connection):
+        """Clean up after a connection was closed. Triggered by the
+        connection's 'disconnected' signal via NetworkAPIConnection.finish()"""
+        self.connections.remove(connection)
+        if connection in self.queue:
+            self.queue.remove(connection)
+        # process waiting connections
+        if self.hasPendingConnections():
+            self.log('Found pending connection, processing..')
+            self.acceptConnection()
+        elif not self.connections and self.isListening():
+            # back to listening
+            self.emitStatusSignal(1)
+
+    def enqueueRequest(self, connection):
+        """Schedule the fully received request of the given connection for
+        execution. Requests are executed one at a time in order of their
+        arrival, while other connections can continue receiving data."""
+        self.queue.append(connection)
+        # executing a request can spin up a local event loop (e.g. while
+        # waiting for the map canvas to redraw), during which other requests
+        # might arrive. these are picked up by the loop below once the
+        # running request has finished
+        if self.busy:
+            return
+        self.busy = True
+        try:
+            while self.queue:
+                connection = self.queue.pop(0)
+                self.emitStatusSignal(3, 'Executing request...')
+                self.executeRequest(connection)
+        finally:
+            self.busy = False
+        if self.isListening():
+            self.emitStatusSignal(1)
+
+    def executeRequest(self, connection):
+        """Execute a command previously retrieved from the registry"""
+        request = connection.request
+        stream = None
+        body = ''
+        vary = []
+        try:
+            # all implemented functions take two arguments
+            result = connection.qgis_call(self.iface, request)
+
+            # extract xml document from nodes and set appropriate content-type
+            if isinstance(result.body, QDomDocument):
+                result.body = result.body.toString()
+                result.content_type = 'text/xml; charset=utf-8'
+
+            # result content-type was set explicitly
+            if result.content_type:
+                body = result.body
+            else:
+                # clients can ask for one of the binary formats in formats.py
+                # instead of JSON
+                result.content_type = preferred(request.headers.get('Accept', ''), RESPONSE_FORMATS) or 'application/json'
+                vary.append('Accept')
+                if result.content_type in BINARY_FORMATS:
+                    body = BINARY_FORMATS[result.content_type](result.body)
+                else:
+                    # autoconvert python classes using the JSONEncoder found
+                    # at the bottom of registry.py (note that GeoJSON results
+                    # are NOT handled here but by the if branch above!)
+                    if NetworkAPIDialog.settings.compact_json():
+                        encoder = QGISJSONEncoder(separators=(',', ':'))
+                    else:
+                        encoder = QGISJSONEncoder(indent=2)
+                    # lazy sequences of features are encoded (and streamed)
+                    # one by one instead of being turned into a list first
+                    body = encoder.iterencode(result.body)
+
+            if isinstance(body, ResponseStream):
+                # produced asynchronously, possibly none of it is available
+                # yet. written as it is (chunks are usually large anyway)
+                stream = body
+                body = ''
+            elif isinstance(body, Iterator):
+                # the body is generated incrementally -- only stream it if it
+                # doesn't fit into a single chunk anyway. retrieving the first
+                # chunk here also means that errors raised early on by the
+                # generating code still result in a proper error response
+                stream = buffered(body)
+                body = next(stream)
+                if len(body) < STREAM_CHUNK_SIZE:
+                    stream = None
+            elif isinstance(body, unicode):
+                body = body.encode('utf-8')
+            elif body == None:
+                body = ''
+            else:
+                body = str(body)
+
+            # compress the response if the client supports it, unless the
+            # body is small or its format is compressed already
+            encoding = None
+            level = NetworkAPIDialog.settings.compression_level()
+            compressible = level > 0 and result.status != 304 and not isinstance(stream, ResponseStream) and not result.content_type.startswith(INCOMPRESSIBLE_TYPES)
+            if compressible and (stream != None or len(body) >= NetworkAPIDialog.settings.compression_threshold()):
+                encoding = acceptedEncoding(request.headers.get('Accept-Encoding', ''))
+            if encoding != None:
+                if stream == None:
+                    compressor = zlib.compressobj(level, zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+                    body = compressor.compress(body) + compressor.flush()
+                else:
+                    stream = compressed(body, stream, encoding, level)
+                    body = ''
+
+            request.send_response(result.status)
+            request.send_header('Content-Type', result.content_type)
+            for name, value in result.headers.iteritems():
+                request.send_header(name, value)
+            if compressible:
+                vary.append('Accept-Encoding')
+            if vary:
+                request.send_header('Vary', ', '.join(vary))
+            if encoding != None:
+                request.send_header('Content-Encoding', encoding)
+            if result.status == 304:
+                # never has a body
+                connection.sendConnectionHeaders()
+            elif stream == None:
+                # the body has to be complete before sending the headers so
+                # that the client can tell where the response ends on a
+                # persistent connection
+                request.send_header('Content-Length', str(len(body)))
+                connection.sendConnectionHeaders()
+            elif request.request_version >= 'HTTP/1.1':
+                request.send_header('Transfer-Encoding', 'chunked')
+                connection.sendConnectionHeaders()
+            else:
+                # HTTP/1.0 clients don't support chunked responses, the end of
+                # the response is signalled by closing the connection instead
+                request.send_header('Connection', 'close')
+            request.end_headers()
+            if stream == None:
+                request.wfile.write(body)
+            # connection will be closed (or kept alive) by sendResponse()
+        except Exception as e:
+            stream = None
+            request.send_http_error(500, str(e))
+            # TODO if request failed, add link to docs at /api?path=... ?
+        request.cleanup()
+        self.showMessage('Executed request #' + str(connection.number) + ': ' + request.log_string)#, QgsMessageBar.SUCCESS)
+        connection.sendResponse(stream, body)
+
+class NetworkAPIConnection(QObject):
+    """A single client connection, accumulating incoming data until a complete
+    request has been received, which is then handed to the server for
+    execution. Every connection has its own inactivity timer and can serve
+    several requests in a row (persistent connections)."""
+
+    def __init__(self, server, socket, number):
+        QObject.__init__(self)
+        self.server = server
+        self.socket = socket
+        # sequential connection number, really just used for logging
+        self.number = number
+        # the request currently being received/executed, if any
+        self.request = None
+        # handler function for the current request, retrieved from registry
+        self.qgis_call = None
+        # true while the current request is waiting for or under execution
+        self.ready = False
+        # number of responses sent over this (persistent) connection
+        self.nresponses = 0
+        # data received beyond the end of the last request on a persistent
+        # connection, i.e. the beginning of a pipelined follow-up request
+        self.pending = ''
+        # chunks of a response body which is still being written, if any
+        self.stream = None
+
+        # timer for interrupting open connections on inactivity
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.timeout)
+
+        self.server.log('Processing connection #' + str(self.number) + ' (' + self.socket.peerAddress().toString() + ')')
+        self.socket.disconnected.connect(self.finish)
+        self.socket.readyRead.connect(self.readFromConnection)
+        self.readFromConnection()
 
     def readFromConnection(self):
         # readAll() doesn't guarantee that there isn't any more data still
         # incoming before reaching the 'end' of the input stream (which, for
         # network connections, is ill-defined anyway). in order to be able to
         # parse incoming requests incrementally, we store the parse request
-        # header in a class variable.
+        # header in an instance variable.
+
+        if self.ready:
+            # data for a pipelined request, leave it in the socket buffer
+            # until the response to the current request has been sent
+            return
 
         # (re)set connection timeout
+        self.timer.setInterval(3000) # 3 seconds, worth making configurable?
         self.timer.start()
 
-        if self.request == None:
-            self.emitStatusSignal(2, 'Connection opened...')
-            if not self.connection.canReadLine():
-                self.log('readyRead() was signalled before full HTTP request line was available for reading (' + str(self.connection.bytesAvailable()) + ' bytes in buffer)', QgsMessageLog.INFO)
+        # the loop is necessary to work around a race condition where data is
+        # added after readAll() but, because the present function is still
+        # busy, readyRead is not emitted again. every chunk is passed on
+        # straight away so that large bodies which are spooled to disk never
+        # have to be held in memory in their entirety.
+        while True:
+            if not self.receive(str(self.socket.readAll())):
                 return
+            if self.request != None and self.request.received >= self.request.content_length:
+                break
+            if not self.socket.waitForReadyRead(0):
+                break
+
+        if self.request == None:
+            # request header still incomplete
+            if self.pending:
+                self.server.emitStatusSignal(2, 'Connection opened...')
+            return
+        # respond to request or -- if data is still incomplete -- do nothing
+        self.processRequest()
+
+    def receive(self, data):
+        """Pass newly read data on to the current request, parsing the
+        request header first if necessary. Returns False if the request was
+        malformed and the connection is being closed."""
+        if self.request == None:
+            # wait for the complete header before parsing the request
+            data = self.pending + data
+            end = HEADER_END.search(data)
+            if end == None:
+                self.pending = data
+                return True
+            self.pending = ''
             # new request, parse header
             try:
-                self.request = NetworkAPIRequest(self.connection)
+                self.request = NetworkAPIRequest(data[:end.end()], self.socket)
             except ValueError:
-                # malformed request line
-                self.sendErrorAndDisconnect(400)
-                return
-        else:
-            # additional data for previous request, append to payload. the loop
-            # is necessary to work around a race condition where data is added
-            # after readAll() but, because the present function is still busy,
-            # readyRead is not emitted again.
-            while True:
-                self.request.headers.set_payload(self.request.headers.get_payload() + self.connection.readAll())
-                if not self.connection.waitForReadyRead(0):
-                    break
-        # respond to request or -- if data is still incomplete -- do nothing
-        self.processRequest()
+                # malformed request line -- no request object to generate a
+                # proper error response from
+                self.server.showMessage('Malformed request on connection #' + str(self.number) + ', disconnecting', QgsMessageBar.WARNING)
+                self.timer.stop()
+                self.socket.disconnectFromHost()
+                return False
+            data = data[end.end():]
+
+        # append data to the request body -- anything beyond the announced
+        # body length belongs to the next request sent over the same
+        # persistent connection
+        self.pending = self.pending + self.request.receive(data)
+        return True
 
     def processRequest(self):
         if NetworkAPIDialog.settings.security():
-            if request.headers['Authorization'] != NetworkAPIDialog.settings.auth():
+            if self.request.headers['Authorization'] != NetworkAPIDialog.settings.auth():
                 # TODO log/message?
                 self.sendErrorAndDisconnect(401)
                 return
 
         # find+call function corresponding to given path
-        qgis_call = Registry.get(self.request.path)
+        self.qgis_call = Registry.get(self.request.path)
 
-        if qgis_call == None:
+        if self.qgis_call == None:
             self.sendErrorAndDisconnect(404)
             return
 
         # if some path that only processes GET requests was submitted with a
         # POST body, we receive + accept it anyway instead of throwing a 405...
-        if self.request.command == 'POST':
-            self.emitStatusSignal(2, 'Processing request: received ' + str(len(self.request.headers.get_payload())) + ' of ' + str(self.request.content_length))
+        if self.request.content_length:
+            self.server.emitStatusSignal(2, 'Processing request: received ' + str(self.request.received) + ' of ' + str(self.request.content_length))
 
-            if len(self.request.headers.get_payload()) < self.request.content_length:
-                # request body incomplete, wait for more data to arrive --
-                # timeout is controlled by the lower-level readFromConnection()
-                return
+        if self.request.received < self.request.content_length:
+            # request body incomplete, wait for more data to arrive --
+            # timeout is controlled by the lower-level readFromConnection()
+            return
 
         # looks like we have all the data, execute call
         self.timer.stop()
+        self.request.finish_body()
 
         # the only payload processing done in the server directly: if the
         # POST content-type is set to JSON, parse
@@ -175,17 +488,120 @@ class NetworkAPIServer(QTcpServer):
                 self.sendErrorAndDisconnect(400)
                 return
 
-        self.emitStatusSignal(3, 'Executing request...')
         # response is written and connection closed in executeRequest()
-        self.executeRequest(qgis_call)
+        self.ready = True
+        self.server.enqueueRequest(self)
+
+    def idle(self):
+        """Whether this is a persistent connection waiting for the client's
+        next request, which can be closed without losing anything"""
+        return self.request == None and self.nresponses > 0 and not self.pending and not self.socket.bytesAvailable()
+
+    def sendConnectionHeaders(self):
+        """Decide whether the connection can be kept open after the current
+        response and send the corresponding headers. Must be called before the
+        end of the response headers."""
+        self.nresponses = self.nresponses + 1
+        # the BaseHTTPRequestHandler has already determined whether the client
+        # wants to keep the connection open, based on the HTTP version and
+        # 'Connection' header of the request. we also close it when the client
+        # has used up its quota of requests, or when other clients are waiting
+        # for a free connection slot.
+        if self.request.close_connection or self.nresponses >= NetworkAPIDialog.settings.keep_alive_max() or self.server.hasPendingConnections():
+            self.request.send_header('Connection', 'close')
+        else:
+            self.request.send_header('Connection', 'keep-alive')
+            self.request.send_header('Keep-Alive', 'timeout=' + str(NetworkAPIDialog.settings.keep_alive_timeout() / 1000) + ', max=' + str(NetworkAPIDialog.settings.keep_alive_max() - self.nresponses))
 
-    def sendResponse(self):
+    def sendResponse(self, stream=None, first=''):
+        """Send the response generated by BaseHTTPRequestHandler. If the
+        response body is streamed, the stream's first chunk has already been
+        retrieved and has to be passed separately."""
+        if self.request == None:
+            # connection was closed by the client while executing the request
+            if stream != None:
+                stream.close()
+            return
         # pass output generated by BaseHTTPRequestHandler on to the QTcpSocket
-        self.connection.write(self.request.wfile.getvalue())
-        # flush response and close connection (i.e. no persistent connections)
-        # calling this will cause a signal to trigger finishConnection() for
-        # actual connection cleanup
-        self.connection.disconnectFromHost()
+        self.socket.write(self.request.wfile.getvalue())
+        # a client which stops receiving the response is disconnected
+        self.timer.setInterval(NetworkAPIDialog.settings.send_timeout())
+        self.timer.start()
+        if stream != None:
+            # the response body follows as the socket's write buffer empties
+            self.stream = stream
+            self.writeChunk(first)
+            self.socket.bytesWritten.connect(self.writeStream)
+            if isinstance(stream, ResponseStream):
+                # also continue once more data has been produced
+                stream.ready.connect(self.writeStream)
+            self.writeStream()
+        else:
+            self.finishResponse()
+
+    def writeChunk(self, chunk):
+        # an empty chunk would signal the end of the response
+        if not chunk:
+            return
+        if self.request.request_version >= 'HTTP/1.1':
+            self.socket.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+        else:
+            self.socket.write(chunk)
+
+    def writeStream(self, _=None):
+        """Write the next chunks of a streamed response body. Called
+        whenever data has been written to the network, which limits the
+        amount of the response that is generated ahead of the client actually
+        receiving it."""
+        # progress was made, either by the client or the generating code
+        self.timer.start()
+        while self.socket.bytesToWrite() < STREAM_BUFFER_SIZE:
+            try:
+                chunk = next(self.stream)
+                if chunk is PENDING:
+                    # wait for the stream's next ready signal
+                    return
+                self.writeChunk(chunk)
+            except StopIteration:
+                if self.request.request_version >= 'HTTP/1.1':
+                    # terminating zero-length chunk
+                    self.socket.write('0\r\n\r\n')
+                break
+            except Exception as e:
+                # too late to send an error response, abort the (incomplete)
+                # response so that the client doesn't mistake it for complete
+                self.server.showMessage('Error while sending response on connection #' + str(self.number) + ': ' + str(e), QgsMessageBar.WARNING)
+                self.request.close_connection = 1
+                self.stream.close()
+                break
+        else:
+            # wait for the next bytesWritten signal
+            return
+        self.stopStream()
+        self.finishResponse()
+
+    def stopStream(self):
+        self.socket.bytesWritten.disconnect(self.writeStream)
+        if isinstance(self.stream, ResponseStream):
+            self.stream.ready.disconnect(self.writeStream)
+        self.stream = None
+
+    def finishResponse(self):
+        if self.request.close_connection:
+            # flush response and close connection. calling this will cause a
+            # signal to trigger finish() for actual connection cleanup
+            self.socket.disconnectFromHost()
+            return
+
+        # persistent connection: wait for the next request from the client
+        self.request = None
+        self.qgis_call = None
+        self.ready = False
+        self.timer.setInterval(NetworkAPIDialog.settings.keep_alive_timeout())
+        self.timer.start()
+        if self.pending or self.socket.bytesAvailable():
+            # pipelined request already (partially) received
+            self.readFromConnection()
 
     def sendErrorAndDisconnect(self, status):
         self.timer.stop()
@@ -193,80 +609,91 @@ class NetworkAPIServer(QTcpServer):
         self.sendResponse()
 
     def timeout(self):
-        if self.connection:
-            self.showMessage('Connection timed out after ' + str(self.timer.interval()) + 'ms', QgsMessageBar.WARNING)
+        if self.stream != None and not self.socket.bytesToWrite():
+            # waiting for the response body to be generated, not for the client
+            self.timer.start()
+            return
+        if self.stream != None or self.socket.bytesToWrite() or self.socket.state() == QAbstractSocket.ClosingState:
+            # the client stopped receiving the response. disconnectFromHost()
+            # would wait for the remaining data to be written forever, so
+            # drop it (which triggers finish(), closing the stream)
+            self.server.showMessage('Connection #' + str(self.number) + ' stalled, no data received by the client for ' + str(self.timer.interval()) + 'ms', QgsMessageBar.WARNING)
+            self.socket.abort()
+            return
+        if self.request == None and self.nresponses:
+            # persistent connection was idle for too long, nothing unusual
+            self.server.log('Closing idle connection #' + str(self.number))
+        else:
+            self.server.showMessage('Connection #' + str(self.number) + ' timed out after ' + str(self.timer.interval()) + 'ms', QgsMessageBar.WARNING)
             # can't make use of the BaseHTTPRequestHandler's send_error code if
             # we haven't even parsed/received a HTTP request line yet...
 #            self.sendErrorAndDisconnect(408)
-            self.connection.disconnectFromHost()
+        self.socket.disconnectFromHost()
 
-    def finishConnection(self):
+    def finish(self):
         """Gracefully disconnect a peer and clean up the network connection.
-        Never called directly, always triggered by the connection's 'disconnected' signal."""
-        self.log('Disconnecting #' + str(self.nrequests) + ' (' + self.connection.peerAddress().toString() + ')')
-        self.connection.readyRead.disconnect(self.readFromConnection)
-        self.connection.disconnected.disconnect(self.finishConnection)
+        Never called directly, always triggered by the socket's 'disconnected' signal."""
+        self.server.log('Disconnecting #' + str(self.number) + ' (' + self.socket.peerAddress().toString() + ')')
+        self.timer.stop()
+        self.socket.readyRead.disconnect(self.readFromConnection)
+        self.socket.disconnected.disconnect(self.finish)
+        self.socket.deleteLater()
+        if self.stream != None:
+            # release any resources held by the generating code
+            stream = self.stream
+            self.stopStream()
+            stream.close()
+        if self.request != None and (not self.ready or self in self.server.queue):
+            # discard a (partial) request body that will never be processed
+            self.request.cleanup()
         self.request = None
-        self.connection = None
-        # process waiting connections
-        if self.hasPendingConnections():
-            self.log('Found pending connection, processing..')
-            self.acceptConnection()
-        else:
-            # back to listening
-            self.emitStatusSignal(1)
-
-    def executeRequest(self, qgis_call):
-        """Execute a command previously retrieved from the registry"""
-        try:
-            # all implemented functions take two arguments
-            result = qgis_call(self.iface, self.request)
-            self.request.send_response(result.status)
-
-            # extract xml document from nodes and set appropriate content-type
-            if isinstance(result.body, QDomDocument):
-                result.body = result.body.toString()
-                result.content_type = 'text/xml; charset=utf-8'
-
-            # result content-type was set explicitly
-            if result.content_type:
-                self.request.send_header('Content-Type', result.content_type)
-                self.request.end_headers()
-                self.request.wfile.write(result.body)
-            else:
-                # autoconvert python classes using the JSONEncoder found at
-                # the bottom of registry.py (note that GeoJSON results are NOT
-                # handled here but by the if branch above!)
-                self.request.send_header('Content-Type', 'application/json')
-                self.request.end_headers()
-                dump(result.body, self.request.wfile, cls=QGISJSONEncoder, indent=2)
-            # connection will be closed by parent function
-        except Exception as e:
-            self.request.send_http_error(500, str(e))
-            # TODO if request failed, add link to docs at /api?path=... ?
-        self.showMessage('Executed request #' + str(self.nrequests) + ': ' + self.request.log_string)#, QgsMessageBar.SUCCESS)
-        self.sendResponse()
+        self.server.connectionClosed(self)
 
 # request parsing
 from BaseHTTPServer import BaseHTTPRequestHandler
 from StringIO import StringIO
 from email import message_from_file # TODO replace by _from_string
+from email.message import Message
 from urlparse import parse_qsl, urlparse
+import re
+
+import os
+from tempfile import mkstemp
+
+# blank line separating the request header from the body
+HEADER_END = re.compile('\r?\n\r?\n')
+
+class NetworkAPIMessage(Message):
+    """Request headers and payload. If the request body was spooled to disk,
+    it is only read into memory when the payload is first accessed."""
+
+    spool_filename = None
+    spool_loaded = False
+
+    def get_payload(self, i=None, decode=False):
+        if self.spool_filename and not self.spool_loaded:
+            self.spool_loaded = True
+            with open(self.spool_filename, 'rb') as spool:
+                self.set_payload(spool.read())
+        return Message.get_payload(self, i, decode)
 
 class NetworkAPIRequest(BaseHTTPRequestHandler):
 
     # default mimetools.Message is deprecated and removed in Python 3. instead,
     # mock function signature for MessageClass(self.rfile, 0) call to email.*
 
-    # this currently loads the entire body of the message into memory, could
-    # do incremental parsing instead and pass the network-inputstream?
-    MessageClass = lambda self, fp, _: message_from_file(fp)
+    # only the request line and headers are passed through the parser, the
+    # body is collected separately by receive() as it arrives
+    MessageClass = lambda self, fp, _: message_from_file(fp, NetworkAPIMessage)
 
-    def __init__(self, connection):
+    # enables persistent connections for HTTP/1.1 clients
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, header, connection):
         self.server_version = 'QGISNetworkAPI/0.0 ' + self.server_version
 
         # mock input/output files for the BaseRequestHandler
-        self.rfile = StringIO(str(connection.readAll()))
+        self.rfile = StringIO(header)
         self.wfile = StringIO()
 
         self.raw_requestline = self.rfile.readline()
@@ -276,8 +703,21 @@ class NetworkAPIRequest(BaseHTTPRequestHandler):
 
         if self.parse_request():
             # class fields now populated: command, path, headers
-            if self.command == 'POST':
-                self.content_length = int(self.headers['Content-Length'])
+            # on persistent connections, the end of the request body can only
+            # be determined from its announced length
+            self.content_length = int(self.headers.get('Content-Length', 0))
+            # the body is stored as a list of chunks as they were received,
+            # and only joined once it is complete. repeatedly appending to a
+            # string instead would copy the entire body on every chunk.
+            self.body = []
+            self.received = 0
+            # large bodies are written to a temporary file as they arrive
+            # instead of being kept in memory
+            self.spool = None
+            if self.content_length > NetworkAPIDialog.settings.spool_threshold():
+                self.spool, self.headers.spool_filename = mkstemp()
+            # whether the spool file was handed over by save_body()
+            self.spool_kept = False
 
             # further parse request path: detach GET arguments
             parsed_path = urlparse(self.path)
@@ -287,6 +727,54 @@ class NetworkAPIRequest(BaseHTTPRequestHandler):
         else:
             raise ValueError('Malformed HTTP request')
 
+    def receive(self, data):
+        """Append newly received data to the request body. Returns any data
+        beyond the announced length of the body."""
+        missing = self.content_length - self.received
+        if len(data) > missing:
+            data, rest = data[:missing], data[missing:]
+        else:
+            rest = ''
+        if data:
+            if self.spool != None:
+                os.write(self.spool, data)
+            else:
+                self.body.append(data)
+            self.received = self.received + len(data)
+        return rest
+
+    def finish_body(self):
+        """Join the body chunks received so far into the message payload"""
+        if self.spool != None:
+            # payload is only read from disk if a handler asks for it
+            os.close(self.spool)
+            self.spool = None
+        else:
+            self.headers.set_payload(''.join(self.body))
+        self.body = None
+
+    def save_body(self):
+        """Return the name of a file containing the request body. The file is
+        not deleted after the request has been processed, so it can serve as
+        the data source of a new layer."""
+        if self.headers.spool_filename:
+            # body was already spooled to disk, hand over the file
+            self.spool_kept = True
+            return self.headers.spool_filename
+        tmpfile, filename = mkstemp()
+        os.write(tmpfile, self.headers.get_payload())
+        os.close(tmpfile)
+        return filename
+
+    def cleanup(self):
+        """Remove the spooled request body from disk, if any"""
+        if self.spool != None:
+            os.close(self.spool)
+            self.spool = None
+        if self.headers.spool_filename and not self.spool_kept:
+            os.remove(self.headers.spool_filename)
+        self.headers.spool_filename = None
+
     def send_http_error(self, code, message=None):
         if message == None:
            self.error_message_format = '%(code)d %(message)s: %(explain)s\n'
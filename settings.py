@@ -23,3 +23,66 @@ class NetworkAPISettings(QSettings):
 
     def log(self):
         return self.value('log', True, bool)
+
+    def compact_json(self):
+        # omit all optional whitespace from JSON responses, rather than
+        # indenting them for human readability
+        return self.value('compact_json', False, bool)
+
+    def compression_level(self):
+        # zlib compression level (1-9) for responses to clients which accept
+        # gzip or deflate encoding, 0 disables compression
+        return self.value('compression_level', 6, int)
+
+    def compression_threshold(self):
+        # responses smaller than this (in bytes) are never compressed
+        return self.value('compression_threshold', 1024, int)
+
+    def max_connections(self):
+        # number of simultaneously open client connections, further incoming
+        # connections are put on hold until one of them is closed
+        return self.value('max_connections', 16, int)
+
+    def spool_threshold(self):
+        # request bodies larger than this (in bytes) are written to a
+        # temporary file as they arrive instead of being kept in memory
+        return self.value('spool_threshold', 16 * 1024 * 1024, int)
+
+    def keep_alive_timeout(self):
+        # idle time (in ms) after which a persistent connection is closed
+        return self.value('keep_alive_timeout', 5000, int)
+
+    def send_timeout(self):
+        # time (in ms) after which a connection is aborted if the client
+        # doesn't receive any of the response still waiting to be sent
+        return self.value('send_timeout', 30000, int)
+
+    def keep_alive_max(self):
+        # number of requests served over one persistent connection before it
+        # is closed, 1 disables persistent connections altogether
+        return self.value('keep_alive_max', 100, int)
+
+    def background_spatial_index(self):
+        # build the spatial index used to answer rectangle queries on layers
+        # without one of their own in the background, rather than during the
+        # first such query
+        return self.value('background_spatial_index', False, bool)
+
+    def tile_cache_memory(self):
+        # size (in bytes) of the rendered map tiles kept in memory
+        return self.value('tile_cache_memory', 64 * 1024 * 1024, int)
+
+    def tile_cache_disk(self):
+        # size (in bytes) of the rendered map tiles kept on disk, 0 disables
+        # the disk cache
+        return self.value('tile_cache_disk', 256 * 1024 * 1024, int)
+
+    def tile_cache_directory(self):
+        # directory of the disk cache, defaults to one in the system's
+        # temporary directory
+        return self.value('tile_cache_directory', '', unicode)
+
+    def render_cache_memory(self):
+        # size (in bytes) of the rendered map images kept in memory, 0
+        # disables caching
+        return self.value('render_cache_memory', 32 * 1024 * 1024, int)
@@ -0,0 +1,224 @@
+# geometric data derived from the features of layers, which is kept around to
+# answer repeated requests for the same layers more quickly
+
+from .cache import LRUCache, layerCache, layerVersion
+from qgis.core import QGis, QgsFeatureRequest, QgsGeometry, QgsMapLayerRegistry, QgsMapToPixelSimplifier, QgsRectangle, QgsSpatialIndex
+from PyQt4.QtCore import QObject, QTimer
+from network_api_dialog import NetworkAPIDialog
+from itertools import chain, islice
+
+# simplified geometries by (layer id, layer version, tolerance, whether
+# topology was preserved, precision, feature id), limited by their total size
+SIMPLIFIED_CACHE_SIZE = 64 * 1024 * 1024
+simplifiedGeometries = layerCache(LRUCache(SIMPLIFIED_CACHE_SIZE, sizeof=lambda geometry: geometry.wkbSize()))
+
+def simplifyGeometry(geometry, tolerance, preserveTopology, precision):
+    """Simplify a geometry and/or round its coordinates to the given number
+    of decimal places"""
+    if tolerance > 0:
+        if preserveTopology:
+            geometry = geometry.simplify(tolerance)
+        else:
+            # much faster, but may produce invalid geometries
+            geometry = QgsMapToPixelSimplifier(QgsMapToPixelSimplifier.SimplifyGeometry, tolerance).simplify(geometry)
+    if precision != None and geometry != None:
+        geometry = QgsGeometry.fromWkt(geometry.exportToWkt(precision))
+    return geometry
+
+def simplified(layer, features, tolerance, preserveTopology=True, precision=None):
+    """Replace the geometries of features of a layer by simplified versions
+    (see simplifyGeometry), reusing previously simplified geometries"""
+    prefix = (layer.id(), layerVersion(layer), tolerance, preserveTopology, precision)
+    for feature in features:
+        geometry = feature.geometry()
+        if geometry != None and not geometry.isEmpty():
+            key = prefix + (feature.id(),)
+            result = simplifiedGeometries.get(key)
+            if result == None:
+                result = simplifyGeometry(geometry, tolerance, preserveTopology, precision)
+                # simplification can fail for invalid geometries
+                if result == None or result.isEmpty():
+                    result = geometry
+                simplifiedGeometries.put(key, result)
+            # the cached geometry must not be modified along with the feature
+            feature.setGeometry(QgsGeometry(result))
+        yield feature
+
+# spatial indexes of layers whose providers don't have one, by (layer id,
+# layer version)
+MAX_SPATIAL_INDEXES = 16
+spatialIndexes = layerCache(LRUCache(MAX_SPATIAL_INDEXES))
+
+# OGR drivers of formats without a spatial index
+UNINDEXED_OGR_DRIVERS = ['GeoJSON', 'CSV', 'KML', 'GML', 'GPX']
+
+def needsSpatialIndex(layer):
+    """Whether spatial queries on a layer would otherwise require a full scan
+    of its data source"""
+    provider = layer.providerType()
+    return provider in ('memory', 'delimitedtext') or (provider == 'ogr' and layer.storageType() in UNINDEXED_OGR_DRIVERS)
+
+def indexRequest():
+    # only the bounding boxes of the geometries are needed
+    return QgsFeatureRequest().setSubsetOfAttributes([])
+
+# number of features added to an index being built in the background before
+# returning to the event loop
+SPATIAL_INDEX_BATCH_SIZE = 10000
+
+class SpatialIndexBuilder(QObject):
+    """Builds the spatial index of a layer piece by piece from the event loop,
+    so that requests can still be served in the meantime"""
+
+    # builders currently running, by (layer id, layer version)
+    running = {}
+
+    def __init__(self, layer, key):
+        QObject.__init__(self)
+        self.key = key
+        self.index = QgsSpatialIndex()
+        self.features = layer.getFeatures(indexRequest())
+        SpatialIndexBuilder.running[key] = self
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.step)
+        self.timer.start(0)
+
+    def step(self):
+        layer = QgsMapLayerRegistry.instance().mapLayer(self.key[0])
+        if layer == None or layerVersion(layer) != self.key[1]:
+            # outdated before it was finished
+            self.finish()
+            return
+        n = 0
+        for feature in islice(self.features, SPATIAL_INDEX_BATCH_SIZE):
+            self.index.insertFeature(feature)
+            n = n + 1
+        if n < SPATIAL_INDEX_BATCH_SIZE:
+            spatialIndexes.put(self.key, self.index)
+            self.finish()
+
+    def finish(self):
+        self.timer.stop()
+        self.features.close()
+        del SpatialIndexBuilder.running[self.key]
+
+def spatialIndex(layer, block=False):
+    """Return the cached spatial index of a layer, building it if necessary.
+    Returns None while the index is being built in the background, unless
+    block is true."""
+    key = (layer.id(), layerVersion(layer))
+    index = spatialIndexes.get(key)
+    if index == None and (block or key not in SpatialIndexBuilder.running):
+        if not block and NetworkAPIDialog.settings.background_spatial_index():
+            SpatialIndexBuilder(layer, key)
+        else:
+            index = QgsSpatialIndex(layer.getFeatures(indexRequest()))
+            spatialIndexes.put(key, index)
+    return index
+
+def resolveFilterRect(layer, featurerequest):
+    """Replace the rectangle filter of a feature request by the ids of the
+    features within it, looked up in the layer's spatial index. Only done if
+    the layer's data source has no spatial index of its own and the request
+    has no other filter."""
+    rect = featurerequest.filterRect()
+    if rect.isNull() or featurerequest.filterType() != QgsFeatureRequest.FilterNone or featurerequest.flags() & QgsFeatureRequest.ExactIntersect:
+        return featurerequest
+    if not needsSpatialIndex(layer):
+        return featurerequest
+    index = spatialIndex(layer)
+    if index != None:
+        featurerequest.setFilterFids(index.intersects(rect))
+        featurerequest.setFilterRect(QgsRectangle())
+    return featurerequest
+
+# geometries of features together with a prepared geometry engine for fast
+# repeated predicates, by (layer id, layer version, feature id)
+MAX_PREPARED_GEOMETRIES = 100000
+preparedGeometries = layerCache(LRUCache(MAX_PREPARED_GEOMETRIES))
+
+def prepared(layer, fids):
+    """Return a dictionary of the (geometry, prepared engine) pairs of the
+    given features of a layer. Features without geometry are left out."""
+    version = layerVersion(layer)
+    result = {}
+    missing = []
+    for fid in fids:
+        entry = preparedGeometries.get((layer.id(), version, fid))
+        if entry == None:
+            missing.append(fid)
+        else:
+            result[fid] = entry
+    if missing:
+        # fetch all missing geometries at once
+        for feature in layer.getFeatures(QgsFeatureRequest().setFilterFids(missing).setSubsetOfAttributes([])):
+            geometry = feature.geometry()
+            if geometry == None or geometry.isEmpty():
+                continue
+            # the engine refers to the geometry, which has to be kept as well
+            geometry = QgsGeometry(geometry)
+            engine = QgsGeometry.createGeometryEngine(geometry.geometry())
+            engine.prepareGeometry()
+            result[feature.id()] = (geometry, engine)
+            preparedGeometries.put((layer.id(), version, feature.id()), result[feature.id()])
+    return result
+
+# the spatial index only knows the bounding boxes of non-point features, so
+# at least this many additional candidates are ranked by their actual distance
+NEAREST_EXTRA_CANDIDATES = 8
+
+def boxDistance(rect, point):
+    """Distance from a point to the nearest point of a rectangle"""
+    dx = max(rect.xMinimum() - point.x(), 0, point.x() - rect.xMaximum())
+    dy = max(rect.yMinimum() - point.y(), 0, point.y() - rect.yMaximum())
+    return (dx * dx + dy * dy) ** 0.5
+
+def nearestFeatures(layer, points, k=1):
+    """For each of the given QgsPoints, find the ids of the k features of a
+    layer nearest to it, the nearest first"""
+    index = spatialIndex(layer, True)
+    if layer.geometryType() == QGis.Point and not QGis.isMultiType(layer.wkbType()):
+        # the bounding box of a single point is the point itself, so the index
+        # ranks the features exactly. it returns all features tied with the
+        # k-th one, though
+        return [index.nearestNeighbor(point, k)[:k] for point in points]
+
+    n = k + NEAREST_EXTRA_CANDIDATES
+    candidates = [index.nearestNeighbor(point, n) for point in points]
+    # prepare the geometries of the first candidates for all points at once
+    geometries = prepared(layer, set(chain(*candidates)))
+    result = []
+    for point, fids in zip(points, candidates):
+        count = n
+        while True:
+            ranked = sorted((geometries[fid][0].distance(QgsGeometry.fromPoint(point)), fid) for fid in fids if fid in geometries)
+            if len(fids) < count:
+                # there are no more features
+                break
+            # candidates are ordered by the distance of their bounding box,
+            # which is a lower bound of the distance of all further features
+            bound = max(boxDistance(geometries[fid][0].boundingBox(), point) for fid in fids if fid in geometries) if ranked else 0
+            if len(ranked) >= k and ranked[k - 1][0] <= bound:
+                break
+            count = count * 2
+            fids = index.nearestNeighbor(point, count)
+            geometries.update(prepared(layer, [fid for fid in fids if fid not in geometries]))
+        result.append([fid for _, fid in ranked[:k]])
+    return result
+
+def containingFeatures(layer, points):
+    """For each of the given QgsPoints, find the id of the (first) feature of
+    a polygon layer containing it, or None"""
+    index = spatialIndex(layer, True)
+    candidates = [sorted(index.intersects(QgsRectangle(point, point))) for point in points]
+    geometries = prepared(layer, set(chain(*candidates)))
+    result = []
+    for point, fids in zip(points, candidates):
+        point = QgsGeometry.fromPoint(point)
+        match = None
+        for fid in fids:
+            if fid in geometries and geometries[fid][1].contains(point.geometry()):
+                match = fid
+                break
+        result.append(match)
+    return result
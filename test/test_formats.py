@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Binary response format tests, using the examples of the CBOR
+specification (RFC 7049, appendix A).
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import unittest
+from collections import OrderedDict
+
+from PyQt4.QtCore import QPyNullVariant
+from qgis.core import QgsPoint
+
+from utilities import get_qgis_app, get_plugin
+QGIS_APP = get_qgis_app()
+formats = get_plugin().formats
+
+
+def cbor(o):
+    return ''.join(formats.toCBOR(o))
+
+
+class CBORTest(unittest.TestCase):
+    """Test the CBOR encoding of response bodies."""
+
+    def test_integers(self):
+        for value, encoded in [
+                (0, '00'), (23, '17'), (24, '1818'), (100, '1864'),
+                (1000, '1903e8'), (1000000, '1a000f4240'),
+                (1000000000000, '1b000000e8d4a51000'),
+                (-1, '20'), (-100, '3863'), (-1000, '3903e7')]:
+            self.assertEqual(cbor(value).encode('hex'), encoded)
+
+    def test_simple_values(self):
+        self.assertEqual(cbor(False), '\xf4')
+        self.assertEqual(cbor(True), '\xf5')
+        self.assertEqual(cbor(None), '\xf6')
+        self.assertEqual(cbor(1.1).encode('hex'), 'fb3ff199999999999a')
+
+    def test_strings(self):
+        self.assertEqual(cbor(''), '\x60')
+        self.assertEqual(cbor(u'IETF'), '\x64IETF')
+        self.assertEqual(cbor(u'ü'), '\x62\xc3\xbc')
+        self.assertEqual(cbor(u'水'), '\x63\xe6\xb0\xb4')
+
+    def test_containers(self):
+        self.assertEqual(cbor([]), '\x80')
+        self.assertEqual(cbor([1, [2, 3], (4, 5)]), '\x83\x01\x82\x02\x03\x82\x04\x05')
+        self.assertEqual(cbor(range(1, 26)).encode('hex'),
+            '98190102030405060708090a0b0c0d0e0f101112131415161718181819')
+        self.assertEqual(cbor({}), '\xa0')
+        self.assertEqual(cbor(OrderedDict([('a', 1), ('b', [2, 3])])), '\xa2\x61a\x01\x61b\x82\x02\x03')
+
+    def test_conversions(self):
+        """Qt and QGIS types are converted as for JSON."""
+        self.assertEqual(cbor(QPyNullVariant(int)), '\xf6')
+        self.assertEqual(cbor(QgsPoint(1, 2)), cbor([1.0, 2.0]))
+        self.assertRaises(TypeError, cbor, object())
+
+    def test_lazy_sequence(self):
+        """Generators are streamed as an array of indefinite length."""
+        chunks = list(formats.toCBOR(x for x in [1, u'a']))
+        self.assertEqual(chunks, ['\x9f', '\x01', '\x61a', '\xff'])
+
+
+if __name__ == "__main__":
+    unittest.main()
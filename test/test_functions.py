@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Feature query helper tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import unittest
+
+from qgis.core import QgsExpression
+
+from utilities import get_qgis_app, get_plugin
+QGIS_APP = get_qgis_app()
+get_plugin()
+from networkapi.functions import keysetFilter
+from networkapi.functions_statistics import aggregateFunction, percentile
+
+
+class KeysetFilterTest(unittest.TestCase):
+    """Test the filter expressions of paginated getFeatures requests."""
+
+    def assertFilter(self, args, expected):
+        expression = keysetFilter(args)
+        self.assertEqual(expression, expected)
+        self.assertFalse(QgsExpression(expression).hasParserError())
+
+    def test_feature_id(self):
+        self.assertFilter({'after': '10'}, '$id > 10')
+
+    def test_ascending(self):
+        self.assertFilter({'after': '10', 'orderBy': 'name', 'afterKey': '"b"'},
+            "(name) > 'b' OR ((name) = 'b' AND $id > 10) OR (name) IS NULL")
+
+    def test_descending_nulls_first(self):
+        """Null keys come before all others, so they are never included
+        after a non-null key."""
+        self.assertFilter({'after': '10', 'orderBy': 'value', 'afterKey': '5', 'ascending': 'n', 'nullsfirst': 'y'},
+            '(value) < 5 OR ((value) = 5 AND $id > 10)')
+
+    def test_null_key(self):
+        self.assertFilter({'after': '10', 'orderBy': 'name', 'afterKey': 'null'},
+            '((name) IS NULL AND $id > 10)')
+        self.assertFilter({'after': '10', 'orderBy': 'name', 'nullsfirst': 'y'},
+            '((name) IS NULL AND $id > 10) OR (name) IS NOT NULL')
+
+
+class PercentileTest(unittest.TestCase):
+    """Test the percentile aggregates of the statistics functions."""
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 50), None)
+        self.assertEqual(percentile([7], 90), 7)
+        self.assertEqual(percentile([4, 1, 3, 2], 50), 2.5)
+        self.assertEqual(percentile([4, 1, 3, 2], 0), 1)
+        self.assertEqual(percentile([4, 1, 3, 2], 100), 4)
+        self.assertAlmostEqual(percentile(range(1, 11), 90), 9.1)
+
+    def test_aggregate_function(self):
+        initial, add, result = aggregateFunction('p25')
+        state = initial()
+        for value in [5, 1, 4, 2, 3]:
+            state = add(state, value)
+        self.assertEqual(result(state), 2)
+        self.assertRaises(ValueError, aggregateFunction, 'p101')
+        self.assertRaises(ValueError, aggregateFunction, 'pmax')
+
+
+if __name__ == "__main__":
+    unittest.main()
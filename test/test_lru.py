@@ -0,0 +1,146 @@
+# coding=utf-8
+"""In-memory and on-disk LRU cache tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+
+import lru
+from lru import DiskCache, LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    """Test eviction by size and age."""
+
+    def setUp(self):
+        self.evicted = []
+        self.now = 1000.0
+        # entries are timestamped with the mocked clock
+        self.clock = lru.time.time
+        lru.time.time = lambda: self.now
+
+    def tearDown(self):
+        lru.time.time = self.clock
+
+    def test_least_recently_used_first(self):
+        cache = LRUCache(2, evicted=lambda key, value: self.evicted.append((key, value)))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(self.evicted, [('b', 2)])
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(len(cache), 2)
+
+    def test_sizes(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'xxxx')
+        # replacing an entry doesn't count its old size
+        cache.put('a', 'xxxxx')
+        self.assertEqual(cache.size, 9)
+        cache.put('c', 'xx')
+        self.assertEqual(sorted(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.size, 7)
+        # entries larger than the cache are not kept
+        cache.put('d', 'x' * 11)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=60, evicted=lambda key, value: self.evicted.append(key))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.now = self.now + 50
+        # accessing an entry renews it
+        cache.get('a')
+        self.now = self.now + 20
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(self.evicted, ['b'])
+
+    def test_pop_and_discard(self):
+        """Entries removed on purpose are not reported as evicted."""
+        cache = LRUCache(10, evicted=lambda key, value: self.evicted.append(key))
+        for key in [('x', 1), ('x', 2), ('y', 1)]:
+            cache.put(key, key[1])
+        self.assertEqual(cache.pop(('x', 1)), 1)
+        self.assertEqual(cache.pop(('x', 1), 'missing'), 'missing')
+        cache.discard(lambda key: key[0] == 'x')
+        self.assertEqual(list(cache.entries), [('y', 1)])
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+        self.assertEqual(self.evicted, [])
+
+
+class DiskCacheTest(unittest.TestCase):
+    """Test the file-based cache."""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def exists(self, key):
+        return os.path.isfile(os.path.join(self.directory, key))
+
+    def test_put_get(self):
+        cache = DiskCache(self.directory, 100)
+        cache.put('a/1.png', 'data')
+        self.assertEqual(cache.get('a/1.png'), 'data')
+        self.assertEqual(cache.get('a/2.png'), None)
+        self.assertFalse(self.exists('a/1.png.tmp'))
+
+    def test_eviction(self):
+        cache = DiskCache(self.directory, 10)
+        cache.put('a', 'x' * 6)
+        cache.put('b', 'x' * 4)
+        cache.get('a')
+        cache.put('c', 'x' * 4)
+        self.assertFalse(self.exists('b'))
+        self.assertTrue(self.exists('a') and self.exists('c'))
+        self.assertEqual(cache.files.size, 10)
+
+    def test_discard(self):
+        cache = DiskCache(self.directory, 100)
+        cache.put('a/1', 'x')
+        cache.put('b/1', 'x')
+        cache.discard(lambda key: key.startswith('a/'))
+        self.assertFalse(self.exists('a/1'))
+        self.assertEqual(cache.get('b/1'), 'x')
+
+    def test_missing_file(self):
+        cache = DiskCache(self.directory, 100)
+        cache.put('a', 'x')
+        os.remove(os.path.join(self.directory, 'a'))
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.files.size, 0)
+
+    def test_existing_files(self):
+        """Files of an earlier session are picked up, the oldest is evicted
+        first."""
+        for name, age in [('old', 20), ('new', 10)]:
+            path = os.path.join(self.directory, name)
+            with open(path, 'wb') as f:
+                f.write('x' * 4)
+            os.utime(path, (time.time() - age, time.time() - age))
+        cache = DiskCache(self.directory, 10)
+        self.assertEqual(cache.get('new'), 'xxxx')
+        cache.put('more', 'x' * 4)
+        self.assertFalse(self.exists('old'))
+        self.assertTrue(self.exists('new'))
+
+
+if __name__ == "__main__":
+    unittest.main()
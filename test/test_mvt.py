@@ -0,0 +1,98 @@
+# coding=utf-8
+"""Vector tile encoder test, using the examples of the Mapbox Vector Tile
+specification (version 2.1, section 4.3.5).
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import struct
+import unittest
+
+from mvt import GeometryEncoder, LayerEncoder, POINT, encodeTile, encodeValue
+
+
+class GeometryEncoderTest(unittest.TestCase):
+    """Test the command sequences of the specification's example geometries."""
+
+    def test_point(self):
+        encoder = GeometryEncoder()
+        encoder.addPoints([(25, 17)])
+        self.assertEqual(encoder.commands, [9, 50, 34])
+
+    def test_multipoint(self):
+        """All points of a multipoint are encoded by a single MoveTo."""
+        encoder = GeometryEncoder()
+        encoder.addPoints([(5, 7), (3, 2)])
+        self.assertEqual(encoder.commands, [17, 10, 14, 3, 9])
+
+    def test_linestring(self):
+        encoder = GeometryEncoder()
+        encoder.addLine([(2, 2), (2, 10), (10, 10)])
+        self.assertEqual(encoder.commands, [9, 4, 4, 18, 0, 16, 16, 0])
+
+    def test_multilinestring(self):
+        encoder = GeometryEncoder()
+        encoder.addLine([(2, 2), (2, 10), (10, 10)])
+        encoder.addLine([(1, 1), (3, 5)])
+        self.assertEqual(encoder.commands, [9, 4, 4, 18, 0, 16, 16, 0, 9, 17, 17, 10, 4, 8])
+
+    def test_polygon(self):
+        encoder = GeometryEncoder()
+        encoder.addRing([(3, 6), (8, 12), (20, 34)], True)
+        self.assertEqual(encoder.commands, [9, 6, 12, 18, 10, 12, 24, 44, 15])
+
+    def test_polygon_winding(self):
+        """Exterior rings given in the wrong winding order are reversed."""
+        encoder = GeometryEncoder()
+        encoder.addRing([(20, 34), (8, 12), (3, 6)], True)
+        self.assertEqual(encoder.commands, [9, 6, 12, 18, 10, 12, 24, 44, 15])
+
+    def test_multipolygon(self):
+        encoder = GeometryEncoder()
+        encoder.addRing([(0, 0), (10, 0), (10, 10), (0, 10)], True)
+        encoder.addRing([(11, 11), (20, 11), (20, 20), (11, 20)], True)
+        encoder.addRing([(13, 13), (13, 17), (17, 17), (17, 13)], False)
+        self.assertEqual(encoder.commands, [
+            9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15,
+            9, 22, 2, 26, 18, 0, 0, 18, 17, 0, 15,
+            9, 4, 13, 26, 0, 8, 8, 0, 0, 7, 15])
+
+
+class LayerEncoderTest(unittest.TestCase):
+    """Test the encoding of attribute values, layers and tiles."""
+
+    def test_values(self):
+        self.assertEqual(encodeValue(u'a'), '\x0a\x01a')
+        self.assertEqual(encodeValue(1.5), '\x19' + struct.pack('<d', 1.5))
+        self.assertEqual(encodeValue(300), '\x28\xac\x02')
+        self.assertEqual(encodeValue(-1), '\x30\x01')
+        self.assertEqual(encodeValue(True), '\x38\x01')
+
+    def test_shared_keys_and_values(self):
+        """Keys and values are stored once per layer, null values are left
+        out."""
+        layer = LayerEncoder(u'points')
+        layer.addFeature(1, POINT, [9, 50, 34], {u'name': u'a', u'other': None})
+        layer.addFeature(2, POINT, [9, 2, 2], {u'name': u'a'})
+        self.assertEqual(layer.keys, {u'name': 0})
+        self.assertEqual(layer.values, {(unicode, u'a'): 0})
+
+    def test_tile(self):
+        layer = LayerEncoder(u'points')
+        layer.addFeature(1, POINT, [9, 50, 34], {u'name': u'a'})
+        feature = '\x08\x01' + '\x12\x02\x00\x00' + '\x18\x01' + '\x22\x03\x09\x32\x22'
+        expected = ('\x78\x02' + '\x0a\x06points' + '\x12' + chr(len(feature)) + feature +
+            '\x1a\x04name' + '\x22\x03\x0a\x01a' + '\x28\x80\x20')
+        self.assertEqual(encodeTile([layer]), '\x1a' + chr(len(expected)) + expected)
+
+    def test_empty_layers(self):
+        """Layers without features are left out."""
+        self.assertEqual(encodeTile([LayerEncoder(u'empty')]), '')
+
+
+if __name__ == "__main__":
+    unittest.main()
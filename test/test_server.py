@@ -0,0 +1,305 @@
+# coding=utf-8
+"""HTTP server tests: content negotiation, request parsing, and the framing
+of responses on persistent connections.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import httplib
+import socket
+import threading
+import time
+import unittest
+import zlib
+
+from PyQt4.QtCore import QCoreApplication, QEventLoop
+
+from utilities import get_qgis_app, get_plugin
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+get_plugin()
+from networkapi.registry import NetworkAPIResult, Registry
+from networkapi.server import (
+    NetworkAPIRequest, NetworkAPIServer, STREAM_CHUNK_SIZE, acceptedEncoding,
+    buffered, compressed, preferred)
+
+
+class PreferredTest(unittest.TestCase):
+    """Test the evaluation of Accept and Accept-Encoding headers."""
+
+    def test_preferred(self):
+        candidates = ['application/json', 'application/cbor']
+        self.assertEqual(preferred('', candidates), None)
+        self.assertEqual(preferred('text/html', candidates), None)
+        self.assertEqual(preferred('Application/CBOR', candidates), 'application/cbor')
+        self.assertEqual(preferred('application/json;q=0.5, application/cbor', candidates), 'application/cbor')
+        # equally fine candidates are picked in the given order
+        self.assertEqual(preferred('application/cbor, application/json', candidates), 'application/json')
+        self.assertEqual(preferred('application/json;q=0, application/cbor;q=x', candidates), None)
+
+    def test_accepted_encoding(self):
+        self.assertEqual(acceptedEncoding('gzip, deflate'), 'gzip')
+        self.assertEqual(acceptedEncoding('gzip;q=0, deflate'), 'deflate')
+        self.assertEqual(acceptedEncoding('br, identity'), None)
+
+
+class StreamTest(unittest.TestCase):
+    """Test the helpers producing streamed response bodies."""
+
+    def test_buffered(self):
+        self.assertEqual(list(buffered(['a', 'b', 'c', 'de', 'f'], 2)), ['ab', 'cde', 'f'])
+        self.assertEqual(list(buffered(['ab'], 2)), ['ab', ''])
+        self.assertEqual(list(buffered([u'\xfc', 1], 2)), ['\xc3\xbc', '1'])
+        self.assertEqual(list(buffered([])), [''])
+
+    def test_compressed(self):
+        class Stream(object):
+            closed = False
+            def __iter__(self):
+                return iter(['b' * 1000, 'c' * 1000])
+            def close(self):
+                self.closed = True
+        stream = Stream()
+        body = ''.join(compressed('a' * 1000, stream, 'gzip', 6))
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), 'a' * 1000 + 'b' * 1000 + 'c' * 1000)
+        self.assertTrue(stream.closed)
+        body = ''.join(compressed('a', Stream(), 'deflate', 1))
+        self.assertEqual(zlib.decompress(body), 'a' + 'b' * 1000 + 'c' * 1000)
+
+
+class Socket(object):
+    """Stand-in for the QTcpSocket of a request."""
+
+    def peerAddress(self):
+        return self
+
+    def toString(self):
+        return '127.0.0.1'
+
+    def peerPort(self):
+        return 12345
+
+
+class RequestTest(unittest.TestCase):
+    """Test the parsing of requests and the collection of their bodies."""
+
+    def test_arguments(self):
+        request = NetworkAPIRequest('GET /qgis/test/?a=1&b=&c=%20 HTTP/1.1\r\nHost: x\r\n\r\n', Socket())
+        self.assertEqual(request.path, '/qgis/test')
+        self.assertEqual(request.args, {'a': '1', 'b': '', 'c': ' '})
+        self.assertEqual(request.content_length, 0)
+        self.assertEqual(request.receive('GET'), 'GET')
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, NetworkAPIRequest, 'nonsense\r\n\r\n', Socket())
+
+    def test_receive(self):
+        """Data beyond the announced body length belongs to the next
+        request."""
+        request = NetworkAPIRequest('POST /qgis/test HTTP/1.1\r\nContent-Length: 5\r\n\r\n', Socket())
+        self.assertEqual(request.receive('ab'), '')
+        self.assertEqual(request.receive('cdeGET /'), 'GET /')
+        self.assertEqual(request.receive('more'), 'more')
+        self.assertEqual(request.received, 5)
+        request.finish_body()
+        self.assertEqual(request.headers.get_payload(), 'abcde')
+        request.cleanup()
+
+
+# handlers of the requests sent by the ServerTest below
+def text(iface, request):
+    # the 'text' argument, or the request body
+    return NetworkAPIResult(request.args.get('text') or request.headers.get_payload(), 'text/plain')
+
+def lines(iface, request):
+    return NetworkAPIResult(('line %d\n' % i for i in xrange(int(request.args['n']))), 'text/plain')
+
+def etag(iface, request):
+    if request.headers.get('If-None-Match') == '"1"':
+        return NetworkAPIResult(None, 'text/plain', 304, {'ETag': '"1"'})
+    return NetworkAPIResult('content', 'text/plain', headers={'ETag': '"1"'})
+
+def values(iface, request):
+    # converted according to the Accept header
+    return NetworkAPIResult([1, 2])
+
+for path, handler in [('/test/text', text), ('/test/lines', lines), ('/test/etag', etag), ('/test/values', values)]:
+    Registry.add_path(path, handler)
+
+# large enough to be streamed
+LINES = 20000
+LINES_BODY = ''.join('line %d\n' % i for i in xrange(LINES))
+
+
+class Server(NetworkAPIServer):
+    """Server which doesn't need the QGIS message bar"""
+
+    def showMessage(self, message, level=0):
+        self.log(message)
+
+
+class Client(object):
+    """Blocking HTTP client sending raw requests over a single connection"""
+
+    def __init__(self, port):
+        self.socket = socket.create_connection(('127.0.0.1', port), 10)
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+    def response(self):
+        """Read the next response, returning (status, headers, body)"""
+        response = httplib.HTTPResponse(self.socket)
+        response.begin()
+        body = response.read()
+        return response.status, dict(response.getheaders()), body
+
+    def closed(self):
+        return self.socket.recv(1) == ''
+
+
+class ServerTest(unittest.TestCase):
+    """Test complete request/response exchanges with a running server."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(IFACE)
+        # any free port
+        cls.server.startServer(0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stopServer()
+
+    def exchange(self, client):
+        """Run the given function with a new Client in a separate thread,
+        processing the server's events until it returns"""
+        result = {}
+        def run():
+            try:
+                result['value'] = client(Client(self.server.serverPort()))
+            except Exception as e:
+                result['error'] = e
+        thread = threading.Thread(target=run)
+        thread.start()
+        deadline = time.time() + 20
+        while thread.is_alive() and time.time() < deadline:
+            QCoreApplication.processEvents(QEventLoop.AllEvents, 50)
+            time.sleep(0.001)
+        thread.join(1)
+        if 'error' in result:
+            raise result['error']
+        self.assertIn('value', result, 'client timed out')
+        return result['value']
+
+    def test_persistent_connection(self):
+        def client(client):
+            responses = []
+            for text in ['a', 'bc']:
+                client.send('GET /test/text?text=' + text + ' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                responses.append(client.response())
+            return responses
+        connections = self.server.nrequests
+        responses = self.exchange(client)
+        self.assertEqual(self.server.nrequests, connections + 1)
+        self.assertEqual([body for _, _, body in responses], ['a', 'bc'])
+        for status, headers, _ in responses:
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['connection'], 'keep-alive')
+        self.assertEqual(responses[1][1]['content-length'], '2')
+
+    def test_pipelining(self):
+        """Requests sent without waiting for the previous response, including
+        a request body and a final request closing the connection."""
+        def client(client):
+            client.send('POST /test/text HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nhello' +
+                'GET /test/text?text=b HTTP/1.1\r\nHost: localhost\r\n\r\n' +
+                'GET /test/text?text=c HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            return [client.response() for _ in range(3)], client.closed()
+        responses, closed = self.exchange(client)
+        self.assertEqual([body for _, _, body in responses], ['hello', 'b', 'c'])
+        self.assertEqual(responses[2][1]['connection'], 'close')
+        self.assertTrue(closed)
+
+    def test_chunked(self):
+        def client(client):
+            client.send('GET /test/lines?n=%d HTTP/1.1\r\nHost: localhost\r\n\r\n' % LINES)
+            first = client.response()
+            client.send('GET /test/text?text=next HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            return first, client.response()
+        (status, headers, body), following = self.exchange(client)
+        self.assertTrue(len(LINES_BODY) > STREAM_CHUNK_SIZE)
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertNotIn('content-length', headers)
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, LINES_BODY)
+        self.assertEqual(following[2], 'next')
+
+    def test_http10(self):
+        """HTTP/1.0 clients get streamed bodies without chunked encoding,
+        delimited by the end of the connection."""
+        def client(client):
+            client.send('GET /test/lines?n=%d HTTP/1.0\r\n\r\n' % LINES)
+            return client.response()
+        status, headers, body = self.exchange(client)
+        self.assertNotIn('transfer-encoding', headers)
+        self.assertEqual(headers['connection'], 'close')
+        self.assertEqual(body, LINES_BODY)
+
+    def test_compressed(self):
+        def client(client):
+            responses = []
+            for path in ['/test/text?text=' + 'x' * 2000, '/test/lines?n=%d' % LINES, '/test/text?text=small']:
+                client.send('GET ' + path + ' HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n')
+                responses.append(client.response())
+            return responses
+        responses = self.exchange(client)
+        for (_, headers, body), expected in zip(responses, ['x' * 2000, LINES_BODY]):
+            self.assertEqual(headers['content-encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', headers['vary'])
+            self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), expected)
+        self.assertEqual(int(responses[0][1]['content-length']), len(responses[0][2]))
+        self.assertEqual(responses[1][1]['transfer-encoding'], 'chunked')
+        # below the compression threshold
+        self.assertNotIn('content-encoding', responses[2][1])
+        self.assertEqual(responses[2][2], 'small')
+
+    def test_not_modified(self):
+        def client(client):
+            client.send('GET /test/etag HTTP/1.1\r\nHost: localhost\r\n\r\n' +
+                'GET /test/etag HTTP/1.1\r\nHost: localhost\r\nIf-None-Match: "1"\r\n\r\n' +
+                'GET /test/text?text=next HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            return [client.response() for _ in range(3)]
+        responses = self.exchange(client)
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(responses[0][2], 'content')
+        status, headers, body = responses[1]
+        self.assertEqual(status, 304)
+        self.assertEqual(headers['etag'], '"1"')
+        self.assertNotIn('content-length', headers)
+        self.assertNotIn('transfer-encoding', headers)
+        self.assertEqual(body, '')
+        # nothing was sent after the headers of the 304 response
+        self.assertEqual(responses[2][2], 'next')
+
+    def test_binary_format(self):
+        def client(client):
+            client.send('GET /test/values HTTP/1.1\r\nHost: localhost\r\nAccept: application/cbor\r\n\r\n')
+            return client.response()
+        status, headers, body = self.exchange(client)
+        self.assertEqual(headers['content-type'], 'application/cbor')
+        self.assertIn('Accept', headers['vary'])
+        self.assertEqual(body, '\x82\x01\x02')
+
+    def test_not_found(self):
+        def client(client):
+            client.send('GET /test/missing HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            return client.response()
+        self.assertEqual(self.exchange(client)[0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
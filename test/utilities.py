@@ -59,3 +59,20 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+def get_plugin():
+    """ Import the plugin's modules, which use relative imports.
+
+    :returns: The plugin package, imported from the repository root under the
+        name 'networkapi' (whatever the checkout directory is called).
+
+    Requires the QGIS python bindings, see get_qgis_app().
+    """
+    import imp
+    import os
+    if 'networkapi' not in sys.modules:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        imp.load_module(
+            'networkapi', None, root, ('', '', imp.PKG_DIRECTORY))
+    return sys.modules['networkapi']